@@ -7,12 +7,12 @@ from flask_compress import Compress
 from flask_caching import Cache
 import os
 
-from .db import db
+from .db import db, ensure_columns, ensure_indexes
 from .forms import UploadFileForm, CheckoutFileForm, ReturnFileForm
 login_manager = LoginManager()
 jwt = JWTManager()
 socketio = SocketIO(cors_allowed_origins="*")
-cache = None
+cache = Cache()
 
 def create_app():
     template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'app', 'templates')
@@ -23,20 +23,41 @@ def create_app():
     app.config["SECRET_KEY"] = os.environ.get('SECRET_KEY', 'default-secret-key')
     app.config["JWT_SECRET_KEY"] = "your-jwt-secret-key"
     app.config['WTF_CSRF_ENABLED'] = False
+    app.config['USE_X_SENDFILE'] = app.config['SENDFILE_MODE'] == 'x-sendfile'
 
     Compress(app)
-    global cache
-    cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+    if app.config["CACHE_TYPE"] == "FileSystemCache" and not app.config["CACHE_DIR"]:
+        app.config["CACHE_DIR"] = os.path.join(app.instance_path, "cache")
+    cache.init_app(app)
+    from .utils import caching  # registers the write-invalidation hooks
 
     db.init_app(app)
     login_manager.init_app(app)
     jwt.init_app(app)
-    # socketio.init_app(app)  # Disabled for testing
+    socketio.init_app(app, message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"])
+    from . import chat_socket  # registers the Socket.IO handlers
 
     from .models import User, FileRecord, FileTransaction, ChatRoom, ChatMessage, AuditLog
 
     with app.app_context():
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        from .utils.search import ensure_search_index
+        ensure_search_index()
+        from .utils.stats import ensure_department_stats
+        ensure_department_stats()
+        from .utils.unread import ensure_unread_counters
+        ensure_unread_counters()
+        from .utils.file_numbering import seed_departments
+        seed_departments()
+
+    from .commands import register_commands
+    register_commands(app)
+
+    if app.config["SCHEDULER_ENABLED"]:
+        from .utils.scheduler import start_scheduler
+        start_scheduler(app)
 
     login_manager.login_view = "auth.login"
 
@@ -49,6 +70,7 @@ def create_app():
     from .routes.auth import bp as auth_bp
     from .routes.chat import bp as chat_bp
     from .routes.admin import bp as admin_bp
+    from .routes.uploads import bp as uploads_bp
     from .api.auth import api_auth
     from .api.chat import api as chat_api
 
@@ -56,27 +78,18 @@ def create_app():
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(chat_bp, url_prefix='/chat')
     app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(uploads_bp, url_prefix='/uploads')
     app.register_blueprint(api_auth, url_prefix='/api/auth')
     app.register_blueprint(chat_api, url_prefix='/api')
     
     @app.context_processor
     def inject_chat_notifications():
         from flask_login import current_user
-        from app.models import ChatRoom, ChatMessage, ChatRoomMember
-        from app.routes.chat import can_access_chat
-        
+        from app.utils.unread import unread_total
+
         if current_user.is_authenticated:
-            # Get unread messages in rooms the user can access
-            total_unread = 0
-            user_memberships = ChatRoomMember.query.filter_by(user_id=current_user.id).all()
-            
-            for membership in user_memberships:
-                # Count messages after last read time
-                unread_count = ChatMessage.query.filter(
-                    ChatMessage.room_id == membership.room_id,
-                    ChatMessage.timestamp > membership.last_read_at
-                ).count()
-                total_unread += unread_count
+            # Cached per user, kept current by the unread counters
+            total_unread = unread_total(current_user.id)
         else:
             total_unread = 0
         
@@ -12,7 +12,7 @@ def admin_required():
     if claims.get("role") != "admin":
         abort(403)
 
-# GET all messages in a room
+# GET a page of messages in a room (?before=/?after= cursors, ?limit=)
 @api.route("/chat/<int:room_id>/messages", methods=["GET"])
 def api_get_messages(room_id):
     if not current_user.is_authenticated:
@@ -23,19 +23,32 @@ def api_get_messages(room_id):
     from app.routes.chat import can_access_chat
     if not can_access_chat(current_user, room):
         return jsonify({"error": "Access denied"}), 403
-        
-    messages = ChatMessage.query.filter_by(room_id=room_id).all()
-    return jsonify([
-        {
-            "id": m.id,
-            "sender": m.sender.name,
-            "message": m.message,
-            "image_filename": m.image_filename,
-            "voice_filename": m.voice_filename,
-            "video_filename": m.video_filename,
-            "timestamp": m.timestamp.isoformat()
-        } for m in messages
-    ])
+
+    from app.utils.chat import message_page
+    try:
+        messages, older_cursor, newer_cursor = message_page(
+            room.id,
+            before=request.args.get("before"),
+            after=request.args.get("after"),
+            limit=request.args.get("limit")
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify({
+        "messages": [
+            {
+                "id": m.id,
+                "sender": m.sender.name,
+                "message": m.message,
+                "image_filename": m.image_filename,
+                "voice_filename": m.voice_filename,
+                "video_filename": m.video_filename,
+                "timestamp": m.timestamp.isoformat()
+            } for m in messages
+        ],
+        "older_cursor": older_cursor,
+        "newer_cursor": newer_cursor
+    })
 
 # POST message in a chat room
 @api.route("/chat/<int:room_id>/messages", methods=["POST"])
@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.models import FileRecord, FileTransaction, User
 from app import db
+from app.utils.loans import issue_file, open_loan_for_file, close_loan
 
 api = Blueprint("files_api", __name__)
 
@@ -59,13 +60,9 @@ def api_checkout_file(file_id):
     if file.is_issued:
         return {"error": "File already issued"}, 400
 
-    tx = FileTransaction(
-        file_id=file.id,
-        user_id=user_id,
-        purpose=data.get("purpose", "")
-    )
-    db.session.add(tx)
-    file.is_issued = True
+    tx = issue_file(file, user_id, purpose=data.get("purpose", ""))
+    if tx is None:
+        return {"error": "File already issued"}, 400
     db.session.commit()
 
     return {"status": "checked out", "file_number": file.file_number}, 201
@@ -78,13 +75,11 @@ def api_return_file(file_id):
     user_id = get_jwt_identity()
 
     file = FileRecord.query.get_or_404(file_id)
-    tx = FileTransaction.query.filter_by(file_id=file.id, user_id=user_id, return_time=None).first()
-    if not tx:
+    tx = open_loan_for_file(file.id)
+    if not tx or str(tx.user_id) != str(user_id):
         return {"error": "No active checkout found"}, 400
 
-    tx.return_time = data.get("return_time")
-    tx.comments = data.get("comments", "")
-    file.is_issued = False
+    close_loan(tx, comments=data.get("comments", ""))
     db.session.commit()
 
     return {"status": "returned", "file_number": file.file_number}, 200
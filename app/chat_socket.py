@@ -1,19 +1,80 @@
+from flask import request
 from flask_socketio import join_room, emit
 from flask_login import current_user
-from app.models import ChatMessage, FileTransaction, FileRecord
+from app.models import ChatMessage, ChatRoom
 from app import db, socketio
-import os
+from app.utils import presence
+
+# Admins with the live monitor open; it is sent small deltas rather than
+# re-querying whole tables
+MONITOR_ROOM = "monitor"
+
+
+def _monitor_update(data):
+    socketio.emit("admin_update", data, to=MONITOR_ROOM)
+
+
+def _presence_update(user, status):
+    _monitor_update({
+        "type": "presence",
+        "status": status,
+        "user_id": user.id,
+        "name": user.name,
+        "role": user.role
+    })
+
+
+@socketio.on("connect")
+def connect(auth=None):
+    if not current_user.is_authenticated:
+        return False
+    if presence.connect(current_user.id, request.sid):
+        _presence_update(current_user, "online")
+
+
+@socketio.on("disconnect")
+def disconnect(reason=None):
+    if current_user.is_authenticated and presence.disconnect(current_user.id, request.sid):
+        _presence_update(current_user, "offline")
+
+
+@socketio.on("heartbeat")
+def heartbeat():
+    if current_user.is_authenticated and presence.touch(current_user.id):
+        _presence_update(current_user, "online")
+
+
+@socketio.on("monitor")
+def monitor():
+    if current_user.is_authenticated and current_user.is_admin():
+        join_room(MONITOR_ROOM)
+
+
+def _accessible_room(room_id):
+    from app.utils.chat import can_access_room
+
+    if not current_user.is_authenticated or not str(room_id).isdigit():
+        return None
+    # Checked against the cached access set before touching the room itself
+    if not can_access_room(current_user, int(room_id)):
+        return None
+    return db.session.get(ChatRoom, int(room_id))
 
 # Join chat room
 @socketio.on("join")
 def join(data):
-    join_room(str(data["room_id"]))
+    room = _accessible_room(data.get("room_id"))
+    if room is not None:
+        join_room(str(room.id))
 
 # Send chat message
 @socketio.on("send_message")
 def send_message(data):
+    room = _accessible_room(data.get("room_id"))
+    if room is None:
+        return
     msg = ChatMessage(
-        room_id=data["room_id"],
+        room_id=room.id,
         sender_id=current_user.id,
         message=data.get("message") if data.get("message") and data.get("message").strip() else None,
         image_filename=data.get("image_filename"),
@@ -22,39 +83,83 @@ def send_message(data):
     )
     db.session.add(msg)
     db.session.commit()
+    emit_new_message(msg, current_user)
 
-    # Emit to room with multimedia support
-    emit_data = {
-        "sender": current_user.name,
+# Deliver a stored message to its room, with multimedia support
+def emit_new_message(msg, sender):
+    socketio.emit("receive_message", {
+        "sender": sender.name,
         "message": msg.message,
         "image_filename": msg.image_filename,
         "voice_filename": msg.voice_filename,
         "video_filename": msg.video_filename,
         "timestamp": msg.timestamp.strftime('%H:%M')
-    }
-    emit("receive_message", emit_data, room=str(data["room_id"]))
+    }, to=str(msg.room_id))
+    emit_chat_update(msg, sender)
 
-    # Emit to admin dashboard
-    emit("admin_update", {
+# New chat message live update
+def emit_chat_update(msg, sender):
+    _monitor_update({
         "type": "chat",
-        "room_id": data["room_id"],
-        "sender": current_user.name,
-        "message": msg.message or "[Media message]"
-    }, broadcast=True)
+        "room_id": msg.room_id,
+        "sender": sender.name,
+        "message": (msg.message or "[Media message]")[:200],
+        "timestamp": msg.timestamp.isoformat()
+    })
 
 # File checkout/return live update
 def emit_file_update(tx, action):
-    if socketio:
-        socketio.emit("admin_update", {
-            "type": "file",
-            "file_number": tx.file.file_number,
-            "user": tx.user.name,
-            "action": action,
-            "timestamp": tx.checkout_time.isoformat() if action=="checkout" else tx.return_time.isoformat()
-        })
-
-@socketio.on('monitor_files')
-def monitor_files():
-    # Simple check for new files (in production, use watchdog library)
-    files = os.listdir('uploads')
-    emit('file_update', {'files': files})
+    _monitor_update({
+        "type": "file",
+        "tx_id": tx.id,
+        "file_number": tx.file.file_number,
+        "user": tx.user.name,
+        "action": action,
+        "timestamp": tx.checkout_time.isoformat() if action=="checkout" else tx.return_time.isoformat()
+    })
+
+# Batch checkout/return live update, one event for the whole handover
+def emit_batch_update(action, user_name, items):
+    _monitor_update({
+        "type": "batch",
+        "action": action,
+        "user": user_name,
+        "count": len(items),
+        "items": items
+    })
+
+# Scanner-station batch checkout/return
+@socketio.on("batch_scan")
+def batch_scan(data):
+    from sqlalchemy.exc import SQLAlchemyError
+    from app.utils.batch import apply_batch
+
+    if not current_user.is_authenticated:
+        emit("batch_result", {"success": False, "message": "Authentication required"})
+        return
+    if not isinstance(data, dict):
+        emit("batch_result", {"success": False, "message": "Invalid batch request"})
+        return
+    action = data.get("action")
+    if action == "return" and not current_user.is_admin():
+        emit("batch_result", {"success": False, "message": "Only admins can return files"})
+        return
+
+    try:
+        results, summary = apply_batch(
+            action,
+            data.get("file_numbers"),
+            current_user,
+            purpose=data.get("purpose"),
+            comments=data.get("comments"),
+            condition=data.get("condition")
+        )
+    except ValueError as e:
+        emit("batch_result", {"success": False, "message": str(e)})
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+        emit("batch_result", {"success": False, "message": "Batch failed, nothing was recorded"})
+        return
+
+    emit("batch_result", {"success": True, "summary": summary, "results": results})
@@ -0,0 +1,140 @@
+import os
+import time
+import click
+
+
+def register_commands(app):
+
+    @app.cli.command("import-files")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--errors", "errors_path", type=click.Path(dir_okay=False),
+                  help="Where to write rejected rows (default: <path>.errors.csv)")
+    @click.option("--chunk-size", default=1000, show_default=True, help="Rows per insert batch")
+    @click.option("--defer-triggers/--keep-triggers", default=True, show_default=True,
+                  help="Suspend search and statistics triggers for the load; "
+                       "keep them if the app is serving writes meanwhile")
+    def import_files(path, errors_path, chunk_size, defer_triggers):
+        """Import a CSV/XLSX register of legacy files."""
+        from app.utils.importer import iter_rows, import_file_records, open_error_writer
+
+        errors_path = errors_path or f"{path}.errors.csv"
+        started = time.monotonic()
+
+        def progress(result):
+            click.echo(
+                f"\r{result.processed} rows, {result.inserted} inserted, "
+                f"{result.duplicates} duplicates, {result.errors} errors",
+                nl=False
+            )
+
+        handle, writer = open_error_writer(errors_path)
+        try:
+            with open(path, "rb") as stream:
+                result = import_file_records(
+                    iter_rows(stream, path), chunk_size=chunk_size,
+                    error_writer=writer, progress=progress, defer_triggers=defer_triggers
+                )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        finally:
+            handle.close()
+
+        click.echo(f"\nDone in {time.monotonic() - started:.1f}s")
+        if result.errors:
+            click.echo(f"Rejected rows written to {errors_path}")
+        else:
+            os.remove(errors_path)
+
+    @app.cli.command("reindex-files")
+    def reindex_files():
+        """Rebuild the file registry full-text index."""
+        from app.utils.search import rebuild_search_index
+        rebuild_search_index()
+        click.echo("File search index rebuilt")
+
+    @app.cli.command("reindex-chat")
+    def reindex_chat():
+        """Rebuild the chat message full-text index."""
+        from app.utils.search import rebuild_message_index
+        rebuild_message_index()
+        click.echo("Chat search index rebuilt")
+
+    @app.cli.command("add-department")
+    @click.argument("name")
+    @click.argument("code")
+    def add_department(name, code):
+        """Register a department and the code used in its file numbers."""
+        from app import db
+        from app.models import Department
+        if Department.query.filter((Department.name == name) | (Department.code == code)).first():
+            raise click.ClickException("Department name or code already registered")
+        db.session.add(Department(name=name, code=code.upper()))
+        db.session.commit()
+        click.echo(f"Added {name} ({code.upper()})")
+
+    @app.cli.command("purge-uploads")
+    @click.option("--hours", type=int, default=None, help="Idle time before a session is purged")
+    def purge_uploads(hours):
+        """Delete abandoned resumable upload sessions."""
+        from app.routes.uploads import purge_stale_uploads
+        click.echo(f"Purged {purge_stale_uploads(hours)} stale upload sessions")
+
+    @app.cli.command("build-previews")
+    def build_previews():
+        """Render missing thumbnails for every stored document version."""
+        from app.models import FileVersion
+        from app.utils.blob_store import blob_path
+        from app.utils.previews import can_preview, missing_previews, render_previews
+        rendered = 0
+        versions = FileVersion.query.with_entities(FileVersion.blob_sha256, FileVersion.content_type).distinct()
+        for digest, content_type in versions:
+            targets = missing_previews(digest) if can_preview(content_type) else []
+            if targets and render_previews(blob_path(digest), content_type, targets):
+                rendered += 1
+        click.echo(f"Rendered previews for {rendered} documents")
+
+    @app.cli.command("migrate-signatures")
+    @click.option("--batch-size", default=200, show_default=True)
+    def migrate_signatures(batch_size):
+        """Move legacy base64 signatures out of file_transactions into the signature store."""
+        from app.utils.signatures import migrate_legacy_signatures
+        moved = migrate_legacy_signatures(batch_size)
+        click.echo(f"Moved {moved} signatures; run VACUUM to reclaim the space on SQLite")
+
+    @app.cli.command("scan-overdue")
+    def scan_overdue():
+        """Queue SMS reminders for overdue loans."""
+        from app.utils.notifications import scan_overdue_loans
+        click.echo(f"Queued {scan_overdue_loans()} overdue reminders")
+
+    @app.cli.command("send-notifications")
+    @click.option("--max-batches", type=int, default=None)
+    def send_notifications(max_batches):
+        """Send queued SMS notifications."""
+        from app.utils.notifications import dispatch_notifications, release_stuck_notifications
+        from app.utils.sms import get_transport
+        try:
+            transport = get_transport()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        release_stuck_notifications()
+        sent, failed = dispatch_notifications(transport=transport, max_batches=max_batches)
+        click.echo(f"Sent {sent}, failed {failed}")
+
+    @app.cli.command("archive-audit")
+    @click.option("--before", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+                  help="Archive entries older than this date (default: AUDIT_RETENTION_MONTHS ago)")
+    def archive_audit(before):
+        """Move old audit entries into monthly audit_log_YYYYMM tables."""
+        from app.utils.audit import archive_audit_log
+        click.echo(f"Archived {archive_audit_log(before)} audit entries")
+
+    @app.cli.command("rollup-activity")
+    @click.option("--rebuild", is_flag=True, help="Recompute existing rollups from history")
+    @click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+                  help="With --rebuild, only recompute from this day")
+    def rollup_activity(rebuild, since):
+        """Roll up daily analytics for closed days; backfills history on first run."""
+        from app.utils.rollups import roll_up_activity, rebuild_activity
+        written = rebuild_activity(since.date() if since else None) if rebuild else roll_up_activity()
+        click.echo(f"Wrote {written} daily activity rows")
@@ -8,3 +8,83 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "jwt-secret")
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
+
+    # Seed entries for the department-code registry used by file numbering;
+    # further departments are added with `flask add-department`.
+    DEPARTMENT_CODES = {
+        "Public Benefit Organisations Regulatory Authority": "PBORA",
+        "Ministry of Interior and National Planning": "MIN",
+        "PBO": "PBO",
+    }
+
+    # Resumable uploads (see routes/uploads.py)
+    UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+    MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 2 * 1024 * 1024 * 1024))
+    UPLOAD_SESSION_TTL_HOURS = 24
+
+    # Download offload: "" streams files from Flask, "x-sendfile" uses Apache/lighttpd
+    # X-Sendfile, "x-accel" uses nginx X-Accel-Redirect with an internal location
+    # aliased to the blob store at X_ACCEL_PREFIX
+    SENDFILE_MODE = os.getenv("SENDFILE_MODE", "")
+    X_ACCEL_PREFIX = os.getenv("X_ACCEL_PREFIX", "/_blobs/")
+
+    # Only compress text responses; documents and chat media are already
+    # compressed, and file responses are streamed so Range/sendfile keep working
+    COMPRESS_MIMETYPES = [
+        "text/html", "text/css", "text/plain", "text/xml", "text/csv",
+        "application/javascript", "application/json", "application/xml",
+    ]
+    COMPRESS_STREAMS = False
+
+    # Shared cache for dashboard, analytics and room-list data (see
+    # utils/caching.py). FileSystemCache is shared by every worker on the host
+    # (CACHE_DIR defaults to instance/cache); use RedisCache with
+    # CACHE_REDIS_URL (needs the redis package) across hosts, or SimpleCache
+    # as a per-process stand-in for development and tests
+    CACHE_TYPE = os.getenv("CACHE_TYPE", "FileSystemCache")
+    CACHE_DIR = os.getenv("CACHE_DIR")
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+    CACHE_KEY_PREFIX = "fts:"
+    CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_THRESHOLD = 5000
+
+    # Threads for background work (document previews, PDF reports)
+    BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", 2))
+
+    # Audit entries not written inside the caller's transaction are buffered
+    # and inserted in batches by a background thread
+    AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "true").lower() == "true"
+    AUDIT_BATCH_SIZE = 200
+    AUDIT_FLUSH_SECONDS = 1.0
+    AUDIT_QUEUE_SIZE = 10000
+    # "flask archive-audit" moves older entries into monthly archive tables
+    AUDIT_RETENTION_MONTHS = 6
+
+    # Socket.IO: set a message queue (e.g. redis://) when running more than
+    # one worker so events reach clients connected to any of them
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+    # Browsers send a heartbeat this often; a user is shown offline once
+    # PRESENCE_TTL passes without one
+    PRESENCE_HEARTBEAT_SECONDS = 25
+    PRESENCE_TTL = 60
+
+    # Loans older than this are overdue; reminders repeat at most this often
+    LOAN_DUE_DAYS = int(os.getenv("LOAN_DUE_DAYS", 7))
+    OVERDUE_REMINDER_HOURS = int(os.getenv("OVERDUE_REMINDER_HOURS", 24))
+
+    # Outbound SMS: "africastalking" or "fake" (records messages, sends
+    # nothing). Unset, reminders still queue but the dispatcher refuses to run
+    SMS_TRANSPORT = os.getenv("SMS_TRANSPORT")
+    AFRICASTALKING_USERNAME = os.getenv("AFRICASTALKING_USERNAME", "sandbox")
+    AFRICASTALKING_API_KEY = os.getenv("AFRICASTALKING_API_KEY", "")
+    AFRICASTALKING_SENDER_ID = os.getenv("AFRICASTALKING_SENDER_ID")
+    SMS_BATCH_SIZE = 50
+    SMS_RATE_PER_SECOND = float(os.getenv("SMS_RATE_PER_SECOND", 5))
+    NOTIFICATION_MAX_ATTEMPTS = 5
+
+    # Run the overdue scanner, SMS dispatcher and analytics rollup in-process;
+    # alternatively leave off and drive "flask scan-overdue",
+    # "flask send-notifications" and "flask rollup-activity" from cron.
+    # With neither, the analytics page queues the rollup itself whenever it
+    # finds closed days missing, but overdue reminders are never scanned
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
@@ -1,6 +1,19 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField,SearchField,SelectField,DateTimeLocalField, FileField
-from wtforms.validators import DataRequired, Email, Length, EqualTo
+from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, Regexp
+
+
+def _clean_phone(value):
+    # Accept "+254 712-345 678" as typed, store "+254712345678".
+    if value:
+        value = value.replace(" ", "").replace("-", "")
+    return value or None
+
+
+PHONE_VALIDATORS = [
+    Optional(),
+    Regexp(r"^\+?[0-9]{9,15}$", message="Enter a mobile number such as +2547XXXXXXXX"),
+]
 
 class LoginForm(FlaskForm):
     email = StringField("Email", validators=[DataRequired(), Email()])
@@ -30,7 +43,7 @@ class ReturnFileForm(FlaskForm):
 class UploadFileForm(FlaskForm):
     file_number = StringField(
         "File Number",
-        validators=[DataRequired(message="File number is required")], render_kw={"placeholder": "OP/218/051/___ "}
+        validators=[Optional()], render_kw={"placeholder": "Leave blank to auto-number"}
     )
     name = StringField("Company Name", render_kw={"placeholder": "Enter your company name"})
     department = StringField("Department")
@@ -46,6 +59,7 @@ class CreateUserForm(FlaskForm):
     designation = StringField("Designation", validators=[DataRequired()])
     email = StringField("Email", validators=[DataRequired(), Email()])
     password = PasswordField("Password", validators=[DataRequired(), Length(min=6)])
+    phone = StringField("Mobile Number", validators=PHONE_VALIDATORS, filters=[_clean_phone], render_kw={"placeholder": "+2547XXXXXXXX"})
     role = SelectField("Role", choices=[("staff", "Staff"), ("admin", "Admin")],default="staff")
     submit = SubmitField("Create User")
     
@@ -76,3 +90,8 @@ class ChangePasswordForm(FlaskForm):
     new_password = PasswordField("New Password", validators=[DataRequired(), Length(min=6)])
     confirm_password = PasswordField("Confirm New Password", validators=[DataRequired(), EqualTo('new_password', message='Passwords must match')])
     submit = SubmitField("Change Password")
+
+
+class PhoneForm(FlaskForm):
+    phone = StringField("Mobile Number", validators=PHONE_VALIDATORS, filters=[_clean_phone], render_kw={"placeholder": "+2547XXXXXXXX"})
+    save_phone = SubmitField("Save Number")
@@ -16,6 +16,8 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(200), nullable=False)
     # Role: "admin" or "staff"
     role = db.Column(db.String(20), default="staff", nullable=False)
+    # Mobile number for SMS reminders, international format e.g. +2547XXXXXXXX
+    phone = db.Column(db.String(20))
     transactions = db.relationship("FileTransaction", backref="user", lazy=True, foreign_keys="FileTransaction.user_id")
     
     def is_admin(self):
@@ -24,6 +26,7 @@ class User(db.Model, UserMixin):
     
 """class FileRecord(db.Model):
     __tablename__ = "files"
+
     id = db.Column(db.Integer, primary_key=True)
     # Identifier used in government institutions
     file_number = db.Column(db.String(100), unique=True, nullable=False)
@@ -43,8 +46,8 @@ class FileRecord(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     file_number = db.Column(db.String(100), unique=True, nullable=False)
-    name = db.Column(db.String(200), nullable=True)
-    department = db.Column(db.String(120), nullable=True)
+    name = db.Column(db.String(200), nullable=True, index=True)
+    department = db.Column(db.String(120), nullable=True, index=True)
 
     # NEW: store uploaded filename
     filename = db.Column(db.String(255), nullable=True, unique=True)
@@ -52,8 +55,102 @@ class FileRecord(db.Model):
     is_issued = db.Column(db.Boolean, default=False)
 
     transactions = db.relationship("FileTransaction", backref="file", lazy=True)
- 
+
+    __table_args__ = (
+        # Keyset sort indexes for the paginated registry (see utils/file_registry.py)
+        db.Index("ix_files_name_sort", db.func.coalesce(name, ""), id),
+        db.Index("ix_files_department_sort", db.func.coalesce(department, ""), id),
+    )
     
+class DepartmentStats(db.Model):
+    __tablename__ = "department_stats"
+
+    # Per-department file counters kept in step with ``files`` by triggers
+    # (see utils/stats.py). Files without a department count under ""
+    department = db.Column(db.String(120), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    issued = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailyActivity(db.Model):
+    __tablename__ = "daily_activity"
+
+    # Per-day rollup of file movements and chat messages for analytics, one
+    # row per (day, department, user); see utils/rollups.py. Messages and
+    # files without a department count under "", events without a user
+    # under user_id 0 (key columns cannot be NULL)
+    day = db.Column(db.Date, primary_key=True)
+    department = db.Column(db.String(120), primary_key=True, default="")
+    user_id = db.Column(db.Integer, primary_key=True, default=0)
+    checkouts = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RollupWatermark(db.Model):
+    __tablename__ = "rollup_watermarks"
+
+    # How far a rollup table has been filled: days before ``until`` are
+    # final, including idle days that produced no rows
+    name = db.Column(db.String(50), primary_key=True)
+    until = db.Column(db.Date, nullable=False)
+
+
+class FileVersion(db.Model):
+    __tablename__ = "file_versions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey("files.id"), nullable=False)
+    # Content address of the stored bytes (see utils/blob_store.py)
+    blob_sha256 = db.Column(db.String(64), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(120))
+    size = db.Column(db.BigInteger)
+    uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    file = db.relationship("FileRecord", backref=db.backref("versions", lazy=True, order_by="FileVersion.id"))
+    uploaded_by = db.relationship("User")
+
+    __table_args__ = (
+        db.Index("ix_file_versions_file_latest", file_id, id),
+    )
+
+
+class UploadSession(db.Model):
+    __tablename__ = "upload_sessions"
+
+    # Opaque token handed to the client for the init / chunk / finalize protocol
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(120))
+    total_size = db.Column(db.BigInteger, nullable=False)
+    # Bytes received so far; the next chunk must start at this offset
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    temp_path = db.Column(db.String(500), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class Department(db.Model):
+    __tablename__ = "departments"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+    # Short code used in generated file numbers, e.g. GOV-2026-PBORA-00001
+    code = db.Column(db.String(20), unique=True, nullable=False)
+
+
+class FileNumberCounter(db.Model):
+    __tablename__ = "file_number_counters"
+
+    # One row per department code and year; allocated with a conditional UPDATE
+    dept_code = db.Column(db.String(20), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+
 class FileTransaction(db.Model):
 
     __tablename__ = "file_transactions"
@@ -72,15 +169,77 @@ class FileTransaction(db.Model):
     # Remarks
     purpose = db.Column(db.String(250))
     comments = db.Column(db.String(250))
-    # Signatures
-    checkout_signature = db.Column(db.Text)  # Base64 encoded signature image
-    return_signature = db.Column(db.Text)    # Base64 encoded signature image
+    # Legacy base64 signatures; new ones live in signature_blobs (see
+    # utils/signatures.py). Deferred so ordinary transaction queries skip them
+    checkout_signature = db.deferred(db.Column(db.Text))
+    return_signature = db.deferred(db.Column(db.Text))
     # File condition on return
     condition = db.Column(db.String(50), default="good")
 
     issued_by = db.relationship("User", foreign_keys=[issued_by_admin_id])
     returned_to = db.relationship("User", foreign_keys=[returned_to_admin_id])
 
+    __table_args__ = (
+        # Partial indexes over open loans only (return_time IS NULL), so "who holds
+        # file X", "what does user U hold" and "open loans by age" stay O(log n)
+        # however much returned history accumulates. See utils/loans.py.
+        db.Index("ix_open_loans_file", file_id,
+                 sqlite_where=return_time.is_(None), postgresql_where=return_time.is_(None)),
+        db.Index("ix_open_loans_user", user_id, checkout_time,
+                 sqlite_where=return_time.is_(None), postgresql_where=return_time.is_(None)),
+        db.Index("ix_open_loans_age", checkout_time,
+                 sqlite_where=return_time.is_(None), postgresql_where=return_time.is_(None)),
+        db.Index("ix_file_transactions_file_checkout", file_id, checkout_time),
+        # Date-range reads for the daily activity rollups (utils/rollups.py)
+        db.Index("ix_file_transactions_checkout_time", checkout_time),
+        db.Index("ix_file_transactions_return_time", return_time),
+    )
+
+
+class SignatureBlob(db.Model):
+    __tablename__ = "signature_blobs"
+
+    # Content address of the compacted image, so identical signatures are stored once
+    sha256 = db.Column(db.String(64), primary_key=True)
+    content_type = db.Column(db.String(50), nullable=False, default="image/png")
+    size = db.Column(db.Integer, nullable=False)
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class TransactionSignature(db.Model):
+    __tablename__ = "transaction_signatures"
+
+    transaction_id = db.Column(db.Integer, db.ForeignKey("file_transactions.id"), primary_key=True)
+    # "checkout" or "return"
+    kind = db.Column(db.String(10), primary_key=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey("signature_blobs.sha256"), nullable=False)
+
+    transaction = db.relationship("FileTransaction")
+
+
+class Notification(db.Model):
+    __tablename__ = "notifications"
+
+    # Outbound message queue, drained in batches by utils/notifications.py
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(20), nullable=False, default="sms")
+    recipient = db.Column(db.String(50), nullable=False)
+    message = db.Column(db.String(500), nullable=False)
+    # pending -> sending -> sent, or back to pending until attempts run out -> failed
+    status = db.Column(db.String(10), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(250))
+    # Stops the same reminder being queued twice, e.g. "overdue:<tx id>:<period>"
+    dedupe_key = db.Column(db.String(100), unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_notifications_due", status, next_attempt_at),
+    )
+
 
 class ChatRoom(db.Model):
     __tablename__ = "chat_rooms"
@@ -109,10 +268,17 @@ class ChatRoomMember(db.Model):
     added_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_read_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Messages from others since last_read_at, kept by triggers (utils/unread.py)
+    unread_count = db.Column(db.Integer, default=0)
 
     user = db.relationship("User", foreign_keys=[user_id])
     added_by = db.relationship("User", foreign_keys=[added_by_id])
 
+    __table_args__ = (
+        db.Index("ix_chat_room_members_room_user", room_id, user_id),
+        db.Index("ix_chat_room_members_user", user_id),
+    )
+
 
 class ChatMessage(db.Model):
     __tablename__ = "chat_messages"
@@ -132,6 +298,12 @@ class ChatMessage(db.Model):
 
     sender = db.relationship("User")
 
+    __table_args__ = (
+        db.Index("ix_chat_messages_timestamp", timestamp),
+        # Keyset paging through a room's history (utils/chat.py)
+        db.Index("ix_chat_messages_room_time", room_id, timestamp, id),
+    )
+
 
 """
 Log:
@@ -146,6 +318,24 @@ class AuditLog(db.Model):
     __tablename__ = "audit_log"
     
     id = db.Column(db.Integer, primary_key=True)
+    # Human-readable description
     action = db.Column(db.String(200))
-    user_id = db.Column(db.Integer)
+    # Action type, e.g. "file.checkout"; see EVENTS in utils/audit.py
+    event = db.Column(db.String(40))
+    # Actor
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    # Target file, if any
+    file_id = db.Column(db.Integer, db.ForeignKey("files.id"))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    actor = db.relationship("User")
+    file = db.relationship("FileRecord")
+
+    # Entries older than AUDIT_RETENTION_MONTHS are moved to monthly
+    # audit_log_YYYYMM tables with the same columns and indexes
+    __table_args__ = (
+        db.Index("ix_audit_log_time", timestamp, id),
+        db.Index("ix_audit_log_actor_time", user_id, timestamp),
+        db.Index("ix_audit_log_file_time", file_id, timestamp),
+        db.Index("ix_audit_log_event_time", event, timestamp),
+    )
@@ -1,11 +1,19 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 from app.models import FileRecord, ChatMessage, FileTransaction
 from app import db
 from app.utils.decorators import admin_required
+from app.utils.file_registry import registry_params, file_registry_page
+from app.utils.loans import open_loans, open_loans_by_age
+from app.utils.signatures import signed_transactions
 
 bp = Blueprint("admin", __name__)
 
+# Selectable analytics windows, in days; the first is the default
+ANALYTICS_RANGES = (30, 90, 365)
+# Rows listed per live monitor panel; the counts cover everything
+MONITOR_LIST_SIZE = 20
+
 from flask import render_template
 from app.models import ChatRoom, FileRecord, AuditLog
 
@@ -14,32 +22,48 @@ from app.models import ChatRoom, FileRecord, AuditLog
 @admin_required
 def dashboard():
     from app.models import User
-    rooms = ChatRoom.query.all()
-    files = FileRecord.query.all()
-    audit_logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).limit(10).all()
+    filters = registry_params(request.args)
+    try:
+        page = file_registry_page(filters, cursor=request.args.get("cursor"), limit=request.args.get("limit"))
+    except ValueError:
+        flash("Invalid page cursor", "warning")
+        return redirect(url_for("admin.dashboard"))
+    files = page.items
+    audit_logs = AuditLog.query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(10).all()
 
-    # Chart data
-    departments = list(set(f.department for f in files))
-    files_per_department = [sum(1 for f in files if f.department==d and f.is_issued) for d in departments]
+    # Chart data from the per-department counters; ``files`` is only the current page
+    from app.utils.stats import department_counts
+    department_stats = department_counts()
+    departments = [d["department"] for d in department_stats]
+    files_per_department = [d["issued"] for d in department_stats]
 
-    # Lifecycle timeline (example)
-    lifecycle_dates = ["2026-01-01","2026-01-02","2026-01-03"]
-    lifecycle_counts = [5, 8, 3]  # Replace with real data
+    # Lifecycle timeline: checkouts and returns per day
+    from app.utils.rollups import activity_series
+    lifecycle_dates, lifecycle_counts, lifecycle_returns, _ = activity_series(14)
 
-    current_checkouts = FileTransaction.query.filter_by(return_time=None).all()
+    # The longest-held loans, with the total from the open-loan index, so
+    # the page costs the same however many files are out
+    current_checkouts = open_loans_by_age(limit=MONITOR_LIST_SIZE)
+    checkout_count = open_loans().count()
+    signed = signed_transactions([tx.id for tx in current_checkouts])
 
     return render_template(
         "admin/dashboard.html",
-        rooms=rooms,
         files=files,
+        next_cursor=page.next_cursor,
+        filters=filters,
         audit_logs=audit_logs,
         departments=departments,
         files_per_department=files_per_department,
+        department_stats=department_stats,
         lifecycle_dates=lifecycle_dates,
         lifecycle_counts=lifecycle_counts,
+        lifecycle_returns=lifecycle_returns,
         user_count=User.query.count(),
-        file_count=len(files),
-        current_checkouts=current_checkouts
+        file_count=sum(d["total"] for d in department_stats),
+        current_checkouts=current_checkouts,
+        checkout_count=checkout_count,
+        signed=signed
     )
 
 
@@ -57,6 +81,7 @@ def create_user():
             designation=form.designation.data,
             email=form.email.data,
             password=generate_password_hash(form.password.data),
+            phone=form.phone.data,
             role=form.role.data
         )
         db.session.add(user)
@@ -66,70 +91,155 @@ def create_user():
     return render_template("admin/create_user.html", form=form)
 
 
+@bp.route("/import", methods=["POST"])
+@login_required
+@admin_required
+def import_files():
+    import os
+    from datetime import datetime
+    from flask import current_app
+    from werkzeug.utils import secure_filename
+    from app.utils.importer import iter_rows, import_file_records, open_error_writer
+
+    upload = request.files.get("register")
+    if not upload or not upload.filename:
+        flash("Choose a CSV or XLSX register to import", "danger")
+        return redirect(url_for("admin.dashboard"))
+
+    import_dir = os.path.join(current_app.instance_path, "imports")
+    os.makedirs(import_dir, exist_ok=True)
+    errors_name = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{secure_filename(upload.filename)}.errors.csv"
+    errors_path = os.path.join(import_dir, errors_name)
+
+    result = None
+    handle, writer = open_error_writer(errors_path)
+    try:
+        result = import_file_records(iter_rows(upload.stream, upload.filename), error_writer=writer)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for("admin.dashboard"))
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Import failed: {str(e)}", "danger")
+        return redirect(url_for("admin.dashboard"))
+    finally:
+        handle.close()
+        # Keep the report only when there are rejected rows to download
+        if result is None or not result.errors:
+            os.remove(errors_path)
+
+    from app.utils.audit import log_action
+    log_action(f"Imported {result.inserted} files from {upload.filename}", event="files.import")
+
+    flash(
+        f"Imported {result.inserted} of {result.processed} rows "
+        f"({result.duplicates} duplicates, {result.errors} rejected)",
+        "success" if not result.errors else "warning"
+    )
+    if result.errors:
+        from markupsafe import Markup
+        flash(Markup('Rejected rows: <a href="{}">download the error report</a>').format(
+            url_for("admin.import_errors", name=errors_name)
+        ), "warning")
+    return redirect(url_for("admin.dashboard"))
+
+
+@bp.route("/import/errors/<name>")
+@login_required
+@admin_required
+def import_errors(name):
+    import os
+    from flask import current_app, send_from_directory
+    return send_from_directory(os.path.join(current_app.instance_path, "imports"), name, as_attachment=True)
+
+
+@bp.route("/audit")
+@login_required
+@admin_required
+def audit_log():
+    from app.models import User
+    from app.utils.audit import EVENTS, archived_months, audit_params, audit_page
+    from app.utils.pagination import page_size
+
+    params = audit_params(request.args)
+    try:
+        page = audit_page(params, cursor=request.args.get("cursor"), limit=page_size(request.args.get("limit")))
+    except ValueError:
+        flash("Invalid page cursor", "warning")
+        return redirect(url_for("admin.audit_log"))
+
+    # Echo the filters back as entered, for the form and the paging links
+    args = {k: v for k, v in request.args.items() if k not in ("cursor", "limit") and v}
+    return render_template(
+        "admin/audit.html",
+        entries=page.items,
+        next_cursor=page.next_cursor,
+        args=args,
+        events=EVENTS,
+        months=archived_months(),
+        users=User.query.order_by(User.name).all(),
+    )
+
+
+@bp.route("/audit/export.csv")
+@login_required
+@admin_required
+def audit_export():
+    from datetime import datetime
+    from flask import Response, stream_with_context
+    from app.utils.audit import audit_params, iter_audit_csv
+
+    params = audit_params(request.args)
+    name = f"audit_{params['month'] or 'current'}_{datetime.utcnow():%Y%m%d_%H%M%S}.csv"
+    return Response(
+        stream_with_context(iter_audit_csv(params)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={name}"},
+    )
+
+
 @bp.route("/analytics")
 @login_required
 @admin_required
 def analytics():
-    from sqlalchemy import func
     from app.models import User
-    
-    total_files = FileRecord.query.count()
-    issued_files = FileRecord.query.filter_by(is_issued=True).count()
-    messages = ChatMessage.query.count()
-    transactions = FileTransaction.query.count()
-    
-    # File transfers per user
-    transfers_per_user = db.session.query(
-        User.name, func.count(FileTransaction.id).label('transfer_count')
-    ).join(User.transactions).group_by(User.id, User.name).all()
-    
-    transfers_labels = [user[0] for user in transfers_per_user]
-    transfers_data = [user[1] for user in transfers_per_user]
-    
-    # Messages per user
-    messages_per_user = db.session.query(
-        User.name, func.count(ChatMessage.id)
-    ).join(ChatMessage).group_by(User.id, User.name).all()
-    
-    messages_labels = [user[0] for user in messages_per_user]
-    messages_data = [user[1] for user in messages_per_user]
-    
-    # Files per department
-    files_per_dept = db.session.query(
-        FileRecord.department, func.count(FileRecord.id)
-    ).group_by(FileRecord.department).all()
-    
-    dept_labels = [dept[0] or 'No Department' for dept in files_per_dept]
-    dept_data = [dept[1] for dept in files_per_dept]
-    
-    # Activity over time (last 7 days)
-    from datetime import datetime, timedelta
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    
-    activity_data = []
-    for i in range(7):
-        day = seven_days_ago + timedelta(days=i)
-        next_day = day + timedelta(days=1)
-        day_transactions = FileTransaction.query.filter(
-            FileTransaction.checkout_time >= day,
-            FileTransaction.checkout_time < next_day
-        ).count()
-        day_messages = ChatMessage.query.filter(
-            ChatMessage.timestamp >= day,
-            ChatMessage.timestamp < next_day
-        ).count()
-        activity_data.append({
-            'date': day.strftime('%Y-%m-%d'),
-            'transactions': day_transactions,
-            'messages': day_messages
-        })
-    
-    activity_labels = [d['date'] for d in activity_data]
-    activity_transactions = [d['transactions'] for d in activity_data]
-    activity_messages = [d['messages'] for d in activity_data]
-    
+    from app.utils.rollups import NO_USER, activity_summary, activity_series
+    from app.utils.stats import department_counts
+
+    days = request.args.get("days", type=int)
+    if days not in ANALYTICS_RANGES:
+        days = ANALYTICS_RANGES[0]
+
+    department_stats = department_counts()
+    total_files = sum(d["total"] for d in department_stats)
+    issued_files = sum(d["issued"] for d in department_stats)
+
+    # Checkouts and messages per user over the range
+    by_user = activity_summary(days, "user_id")
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_(list(by_user))).all())
+    names[NO_USER] = "Unknown"
+    transfers_per_user = sorted(
+        ((names.get(u, f"User {u}"), c) for u, (c, _, _) in by_user.items() if c), key=lambda x: -x[1]
+    )
+    messages_per_user = sorted(
+        ((names.get(u, f"User {u}"), m) for u, (_, _, m) in by_user.items() if m), key=lambda x: -x[1]
+    )
+
+    transfers_labels = [name for name, _ in transfers_per_user]
+    transfers_data = [n for _, n in transfers_per_user]
+    messages_labels = [name for name, _ in messages_per_user]
+    messages_data = [n for _, n in messages_per_user]
+    messages = sum(messages_data)
+    transactions = sum(transfers_data)
+
+    # Files per department, from the maintained counters
+    dept_labels = [d["department"] for d in department_stats]
+    dept_data = [d["total"] for d in department_stats]
+
+    activity_labels, activity_transactions, activity_returns, activity_messages = activity_series(days)
+
     chart_data = {
-        "labels": ["Total Files", "Issued Files", "Messages", "Transactions"],
+        "labels": ["Total Files", "Issued Files", f"Messages ({days} days)", f"Checkouts ({days} days)"],
         "datasets": [{
             "label": "Counts",
             "data": [total_files, issued_files, messages, transactions],
@@ -173,6 +283,12 @@ def analytics():
                 "borderColor": "#FF6384",
                 "backgroundColor": "rgba(255, 99, 132, 0.2)"
             },
+            {
+                "label": "Returns",
+                "data": activity_returns,
+                "borderColor": "#4BC0C0",
+                "backgroundColor": "rgba(75, 192, 192, 0.2)"
+            },
             {
                 "label": "Messages",
                 "data": activity_messages,
@@ -192,7 +308,9 @@ def analytics():
         transfers_chart=transfers_chart,
         messages_chart=messages_chart,
         dept_chart=dept_chart,
-        activity_chart=activity_chart
+        activity_chart=activity_chart,
+        days=days,
+        ranges=ANALYTICS_RANGES
     )
 
 
@@ -200,27 +318,38 @@ def analytics():
 @login_required
 @admin_required
 def live_monitor():
-    from app.models import User, FileRecord, ChatMessage, FileTransaction
-    from datetime import datetime, date
-    
-    # Get today's date
-    today = date.today()
-    today_start = datetime.combine(today, datetime.min.time())
-    
-    # Active users - for now, all users (in production, track online status)
-    active_users = User.query.all()
-    
-    # Total files
-    total_files = FileRecord.query.all()
-    
-    # Messages today
-    messages_today = ChatMessage.query.filter(ChatMessage.timestamp >= today_start).order_by(ChatMessage.timestamp.desc()).limit(10).all()
-    
-    # Active transactions
-    active_transactions = FileTransaction.query.filter_by(return_time=None).all()
-    
+    """Initial snapshot; the page then applies Socket.IO deltas (see chat_socket)."""
+    from app.models import ChatMessage, FileTransaction
+    from app.utils.loans import open_loans
+    from app.utils.presence import online_users
+    from app.utils.stats import department_counts
+    from sqlalchemy.orm import joinedload
+    from datetime import datetime
+
+    today_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+    # Users with a live connection or a recent heartbeat
+    active_users = online_users()
+
+    total_file_count = sum(d["total"] for d in department_counts())
+
+    # Messages today: count from the timestamp index, latest few listed
+    messages_today = ChatMessage.query.filter(ChatMessage.timestamp >= today_start)
+    messages_today_count = messages_today.count()
+    messages_today = messages_today.options(joinedload(ChatMessage.sender)) \
+        .order_by(ChatMessage.timestamp.desc()).limit(MONITOR_LIST_SIZE).all()
+
+    # Active transactions: count from the open-loan index, newest few listed
+    active_transaction_count = open_loans().count()
+    active_transactions = open_loans().options(
+        joinedload(FileTransaction.file), joinedload(FileTransaction.user)
+    ).order_by(FileTransaction.checkout_time.desc()).limit(MONITOR_LIST_SIZE).all()
+
     return render_template("admin/live_monitor.html",
                          active_users=active_users,
-                         total_files=total_files,
+                         total_file_count=total_file_count,
                          messages_today=messages_today,
-                         active_transactions=active_transactions)
+                         messages_today_count=messages_today_count,
+                         active_transactions=active_transactions,
+                         active_transaction_count=active_transaction_count,
+                         list_size=MONITOR_LIST_SIZE)
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from app.forms import LoginForm, CreateUserForm, ChangePasswordForm
+from app.forms import LoginForm, CreateUserForm, ChangePasswordForm, PhoneForm
 from app.models import User
 from app import db
 
@@ -27,6 +27,7 @@ def signup():
             designation=form.designation.data,
             email=form.email.data,
             password=generate_password_hash(form.password.data),
+            phone=form.phone.data,
             role=form.role.data
         )
         db.session.add(user)
@@ -45,7 +46,14 @@ def logout():
 @login_required
 def profile():
     form = ChangePasswordForm()
-    if form.validate_on_submit():
+    phone_form = PhoneForm(phone=current_user.phone)
+    # Both forms post to this view; the submit button says which one it was.
+    if phone_form.save_phone.data and phone_form.validate_on_submit():
+        current_user.phone = phone_form.phone.data
+        db.session.commit()
+        flash("Mobile number updated", "success")
+        return redirect(url_for("auth.profile"))
+    if form.submit.data and form.validate_on_submit():
         if check_password_hash(current_user.password, form.current_password.data):
             current_user.password = generate_password_hash(form.new_password.data)
             db.session.commit()
@@ -53,4 +61,4 @@ def profile():
             return redirect(url_for("auth.profile"))
         else:
             flash("Current password is incorrect", "danger")
-    return render_template("auth/profile.html", form=form)
+    return render_template("auth/profile.html", form=form, phone_form=phone_form)
@@ -1,58 +1,78 @@
-from flask import Blueprint, render_template, redirect, url_for, abort, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, abort, flash, request, current_app, send_from_directory
 from flask_login import login_required, current_user
 from app.models import ChatRoom, ChatMessage, FileTransaction, ChatRoomMember, User
 from app.forms import ChatMessageForm, CreateChatRoomForm, DeleteChatRoomForm
-from app import db, socketio
+from app import db
+from app.utils.blob_store import save_upload, media_name, media_digest, guess_type
+from app.utils.downloads import send_blob
 from datetime import datetime
 import os
 
 bp = Blueprint('chat', __name__)
 
 def can_access_chat(user, room):
-    # Admins can access all rooms
-    if user.is_admin():
-        return True
+    # Admins, members, and holders of the room's file (see utils/chat.py)
+    from app.utils.chat import can_access_room
+    return can_access_room(user, room.id)
 
-    # Check if user is a member of the room
-    member = ChatRoomMember.query.filter_by(room_id=room.id, user_id=user.id).first()
-    if member:
-        return True
+def store_media(file_storage):
+    digest, _ = save_upload(file_storage)
+    return media_name(digest, file_storage.filename)
 
-    # If room is linked to a file, check if user has that file checked out
-    if room.file:
-        return FileTransaction.query.filter_by(
-            file_id=room.file.id,
-            user_id=user.id,
-            return_time=None
-        ).first() is not None
 
-    return False
+@bp.route("/media/<name>")
+@login_required
+def media(name):
+    digest = media_digest(name)
+    if digest is None:
+        # Media sent before the blob store existed
+        return send_from_directory(os.path.join(current_app.config['UPLOAD_FOLDER'], 'chat'), name)
+    return send_blob(digest, guess_type(name), immutable=True)
 
 @bp.route("/rooms")
 @login_required
 def rooms():
-    rooms = ChatRoom.query.all()
+    from app.utils.chat import room_summaries, accessible_room_ids
+    from app.utils.unread import unread_by_room
+    rooms = room_summaries()
     form = CreateChatRoomForm()
     
-    # Calculate unread messages for each room
+    # Unread messages for each room, from the member's counter
+    accessible = accessible_room_ids(current_user)
+    unread = unread_by_room(current_user.id)
     room_unread_counts = {}
     for room in rooms:
-        if can_access_chat(current_user, room):
-            membership = ChatRoomMember.query.filter_by(room_id=room.id, user_id=current_user.id).first()
-            if membership:
-                unread_count = ChatMessage.query.filter(
-                    ChatMessage.room_id == room.id,
-                    ChatMessage.timestamp > membership.last_read_at
-                ).count()
-                room_unread_counts[room.id] = unread_count
-            else:
-                # If user can access but no membership record, show all messages as unread
-                room_unread_counts[room.id] = len(room.messages)
+        if accessible is None or room.id in accessible:
+            # If user can access but no membership record, show all messages as unread
+            room_unread_counts[room.id] = unread.get(room.id, room.message_count)
         else:
             room_unread_counts[room.id] = 0
     
     return render_template("chat/rooms.html", rooms=rooms, form=form, room_unread_counts=room_unread_counts)
 
+@bp.route("/search")
+@login_required
+def search():
+    from app.utils.chat import accessible_room_ids, room_summaries
+    from app.utils.search import message_search_params, search_messages
+
+    params = message_search_params(request.args)
+    accessible = accessible_room_ids(current_user)
+    results, has_next = search_messages(params, room_ids=accessible)
+
+    # Echo the filters back as entered, for the form and the paging links
+    args = {k: v for k, v in request.args.items() if k != "page" and v}
+    rooms = [r for r in room_summaries() if accessible is None or r.id in accessible]
+    return render_template(
+        "chat/search.html",
+        results=results,
+        has_next=has_next,
+        page=params["page"],
+        args=args,
+        rooms=rooms,
+        users=User.query.order_by(User.name).all(),
+    )
+
 @bp.route("/create_room", methods=["GET", "POST"])
 @login_required
 def create_room():
@@ -123,58 +143,42 @@ def chat_room(room_id):
             message=form.message.data if form.message.data and form.message.data.strip() else None
         )
         
-        # Handle file uploads
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        chat_uploads = os.path.join(upload_folder, 'chat')
-        os.makedirs(chat_uploads, exist_ok=True)
-        
+        # Handle file uploads: media goes into the content-addressed store and
+        # the message keeps a "<sha256><ext>" reference, so resent media is stored once
         if form.image.data:
-            filename = f"img_{room.id}_{current_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{form.image.data.filename}"
-            filepath = os.path.join(chat_uploads, filename)
-            form.image.data.save(filepath)
-            msg.image_filename = filename
+            msg.image_filename = store_media(form.image.data)
             
         if form.voice_note.data:
-            filename = f"voice_{room.id}_{current_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{form.voice_note.data.filename}"
-            filepath = os.path.join(chat_uploads, filename)
-            form.voice_note.data.save(filepath)
-            msg.voice_filename = filename
+            msg.voice_filename = store_media(form.voice_note.data)
             
         if form.video_note.data:
-            filename = f"video_{room.id}_{current_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{form.video_note.data.filename}"
-            filepath = os.path.join(chat_uploads, filename)
-            form.video_note.data.save(filepath)
-            msg.video_filename = filename
+            msg.video_filename = store_media(form.video_note.data)
         
         db.session.add(msg)
         db.session.commit()
         
         # Emit message to room via Socket.IO for real-time updates
-        socketio.emit('receive_message', {
-            "sender": current_user.name,
-            "message": msg.message,
-            "image_filename": msg.image_filename,
-            "voice_filename": msg.voice_filename,
-            "video_filename": msg.video_filename,
-            "timestamp": msg.timestamp.strftime('%H:%M')
-        }, room=str(room.id))
+        from app.chat_socket import emit_new_message
+        emit_new_message(msg, current_user)
         
         return redirect(url_for("chat.chat_room", room_id=room.id))
 
-    messages = ChatMessage.query.filter_by(room_id=room.id).all()
+    # Messages are paged in by the page itself (api_get_messages); only the count here
+    message_count = ChatMessage.query.filter_by(room_id=room.id).count()
     members = ChatRoomMember.query.filter_by(room_id=room.id).all()
     
     # Mark room as read for current user
     member = ChatRoomMember.query.filter_by(room_id=room_id, user_id=current_user.id).first()
     if member:
-        member.last_read_at = datetime.utcnow()
+        from app.utils.unread import mark_read
+        mark_read(member, datetime.utcnow())
         db.session.commit()
     
     # Get available users (not already in the room)
     member_user_ids = [member.user_id for member in members]
     available_users = User.query.filter(~User.id.in_(member_user_ids)).all()
     
-    return render_template("chat/chat_room.html", room=room, messages=messages, form=form, members=members, available_users=available_users)
+    return render_template("chat/chat_room.html", room=room, message_count=message_count, form=form, members=members, available_users=available_users)
 
 @bp.route("/<int:room_id>/add_user", methods=["POST"])
 @login_required
@@ -1,24 +1,75 @@
 from fileinput import filename
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_from_directory, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_from_directory, send_file, jsonify, abort
 from flask_login import login_required, current_user
-from app.models import FileRecord, FileTransaction
+from app.models import FileRecord, FileTransaction, FileVersion
 from app.forms import CheckoutFileForm, ReturnFileForm, UploadFileForm
-from app import db, cache
+from app import db
 from datetime import datetime
+from sqlalchemy import func
 import os
-import shutil
+import re
 from app.utils.decorators import admin_required
+from app.utils.file_registry import registry_params, file_registry_page, serialize_file
+from app.utils.loans import open_loan_for_file, issue_file, close_loan, file_history_page, serialize_transaction
+from app.utils.blob_store import save_upload, guess_type
+from app.utils.downloads import send_blob
+from app.utils.previews import PREVIEW_SIZES, PREVIEW_MIMETYPE, can_preview, preview_key, preview_path, schedule_previews
 
 bp = Blueprint('files', __name__)
 
 @bp.route('/dashboard')
 @login_required
 def dashboard():
-    files = FileRecord.query.all()
+    filters = registry_params(request.args)
+    try:
+        page = file_registry_page(filters, cursor=request.args.get('cursor'), limit=request.args.get('limit'))
+    except ValueError:
+        flash("Invalid page cursor", "warning")
+        return redirect(url_for("files.dashboard"))
     form = UploadFileForm()
     checkout_form = CheckoutFileForm()
     return_form = ReturnFileForm()
-    return render_template('files/dashboard.html', files=files, form=form, checkout_form=checkout_form, return_form=return_form)
+    thumbnails = {
+        file_id: version.blob_sha256
+        for file_id, version in latest_versions([f.id for f in page.items]).items()
+        if can_preview(version.content_type)
+    }
+    return render_template('files/dashboard.html', files=page.items, next_cursor=page.next_cursor, filters=filters, thumbnails=thumbnails, form=form, checkout_form=checkout_form, return_form=return_form)
+
+
+@bp.route('/registry')
+@login_required
+def registry():
+    filters = registry_params(request.args)
+    try:
+        page = file_registry_page(filters, cursor=request.args.get('cursor'), limit=request.args.get('limit'))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify({
+        "files": [serialize_file(f) for f in page.items],
+        "next_cursor": page.next_cursor
+    })
+
+
+@bp.route('/search')
+@login_required
+def search():
+    from app.utils.search import search_files
+    from app.utils.pagination import page_size
+    files = search_files(request.args.get('q', ''), limit=page_size(request.args.get('limit'), default=20))
+    return jsonify({"files": [serialize_file(f) for f in files]})
+
+
+@bp.route('/typeahead')
+@login_required
+def typeahead():
+    from app.utils.search import typeahead_files
+    from app.utils.pagination import page_size
+    files = typeahead_files(request.args.get('q', ''), limit=min(page_size(request.args.get('limit'), default=10), 25))
+    return jsonify([
+        {"file_number": f.file_number, "name": f.name, "department": f.department, "is_issued": f.is_issued}
+        for f in files
+    ])
 
 
 """@bp.route("/return", methods=["POST"])
@@ -120,10 +171,7 @@ def return_file():
             return redirect(url_for("files.dashboard"))
         
         # Find the active transaction for this file
-        tx = FileTransaction.query.filter_by(
-            file_id=file.id,
-            return_time=None
-        ).first()
+        tx = open_loan_for_file(file.id)
         
         if not tx:
             flash("File is not currently checked out", "danger")
@@ -131,27 +179,24 @@ def return_file():
         
         try:
             # Process the return
-            tx.return_time = datetime.utcnow()
-            tx.comments = form.comments.data
-            tx.condition = form.condition.data
-            # tx.return_signature = form.return_signature.data
-            tx.returned_to_admin_id = current_user.id
-            file.is_issued = False
-            
+            close_loan(
+                tx,
+                comments=form.comments.data,
+                condition=form.condition.data,
+                # return_signature=form.return_signature.data,
+                returned_to_admin_id=current_user.id
+            )
+
+            from app.utils.audit import log_action
+            log_action(f"File {file.file_number} returned", commit=False, event="file.return", file=file)
+
             db.session.commit()
             
             flash(f"File {file.file_number} returned successfully", "success")
             
-            # Clear any cached dashboard data
-            cache.delete_memoized(dashboard)
-            
             # Emit socket event
-            # from app.chat_socket import emit_file_update
-            # emit_file_update(tx, "return")
-            
-            # Log the action
-            from app.utils.audit import log_action
-            log_action(f"File {file.file_number} returned")
+            from app.chat_socket import emit_file_update
+            emit_file_update(tx, "return")
             
             return redirect(url_for("files.dashboard"))
             
@@ -273,24 +318,25 @@ def checkout():
         return redirect(url_for("files.dashboard"))
 
     try:
-        tx = FileTransaction(
-            file_id=file.id,
-            user_id=current_user.id,
+        tx = issue_file(
+            file,
+            current_user.id,
             purpose=form.purpose.data,
             checkout_signature=form.checkout_signature.data
         )
 
-        file.is_issued = True
-        db.session.add(tx)
-        db.session.commit()
+        if tx is None:
+            flash("File is already checked out", "warning")
+            return redirect(url_for("files.dashboard"))
 
-        cache.delete_memoized(dashboard)
+        from app.utils.audit import log_action
+        log_action(f"File {file.file_number} checked out by {current_user.name}", commit=False,
+                   event="file.checkout", file=file)
 
-        # from app.chat_socket import emit_file_update
-        # emit_file_update(tx, "checkout")
+        db.session.commit()
 
-        from app.utils.audit import log_action
-        log_action(f"File {file.file_number} checked out by {current_user.name}")
+        from app.chat_socket import emit_file_update
+        emit_file_update(tx, "checkout")
 
         flash("File checked out successfully", "success")
 
@@ -303,6 +349,146 @@ def checkout():
 
 
 
+@bp.route("/batch", methods=["POST"])
+@login_required
+def batch():
+    """Scanner-station mode: apply a list of scanned file numbers in one request."""
+    from app.utils.batch import apply_batch
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Invalid batch request"}), 400
+    action = data.get("action")
+    if action == "return" and not current_user.is_admin():
+        return jsonify({"success": False, "message": "Only admins can return files"}), 403
+
+    try:
+        results, summary = apply_batch(
+            action,
+            data.get("file_numbers"),
+            current_user,
+            purpose=data.get("purpose"),
+            comments=data.get("comments"),
+            condition=data.get("condition")
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Batch failed: {str(e)}"}), 500
+
+    return jsonify({"success": True, "summary": summary, "results": results})
+
+
+@bp.route("/codes/<kind>.<fmt>")
+@login_required
+def code_image(kind, fmt):
+    """Barcode or QR image for ``?value=``, rendered in memory on demand."""
+    from app.utils.barcode import KINDS, FORMATS, code_etag, render_code
+
+    value = (request.args.get("value") or "").strip()
+    if kind not in KINDS or fmt not in FORMATS or not value or len(value) > 200:
+        abort(404)
+
+    response = current_app.response_class(mimetype=FORMATS[fmt])
+    response.set_etag(code_etag(kind, value, fmt))
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    if request.if_none_match.contains(response.get_etag()[0]):
+        return response.make_conditional(request)
+    try:
+        response.set_data(render_code(kind, value, fmt))
+    except Exception:
+        # e.g. characters Code128 cannot encode
+        abort(404)
+    return response
+
+
+def _selected_numbers(file_numbers):
+    # Stripped, blanks dropped, duplicates removed in the order they were picked
+    return list(dict.fromkeys(n for n in (str(n).strip() for n in file_numbers if n is not None) if n))
+
+
+def _selected_labels(file_numbers):
+    # ``file_numbers`` as returned by _selected_numbers; looked up in chunks
+    for start in range(0, len(file_numbers), 500):
+        chunk = file_numbers[start:start + 500]
+        names = dict(db.session.query(FileRecord.file_number, FileRecord.name).filter(
+            FileRecord.file_number.in_(chunk)
+        ).all())
+        for number in chunk:
+            if number in names:
+                yield number, names[number]
+
+
+@bp.route("/labels", methods=["POST"])
+@login_required
+def print_labels():
+    """Printable label sheet for the selected files, or for every file matching the registry filters."""
+    import tempfile
+    from app.utils.background import offload
+    from app.utils.barcode import MAX_LABELS, write_label_sheet
+    from app.utils.file_registry import filter_files
+
+    data = request.get_json(silent=True) or request.form
+    file_numbers = data.get("file_numbers") or []
+    if isinstance(file_numbers, str):
+        file_numbers = file_numbers.splitlines()
+
+    if file_numbers:
+        file_numbers = _selected_numbers(file_numbers)
+        total = len(file_numbers)
+        labels = _selected_labels(file_numbers)
+    else:
+        params = registry_params(data)
+        query = filter_files(FileRecord.query, params["department"], params["is_issued"], params["name"])
+        total = query.count()
+        labels = query.with_entities(FileRecord.file_number, FileRecord.name).order_by(
+            FileRecord.file_number
+        ).yield_per(1000)
+
+    if total > MAX_LABELS:
+        if request.is_json:
+            return jsonify({"error": f"Select at most {MAX_LABELS} files per label sheet"}), 400
+        flash(f"Select at most {MAX_LABELS} files per label sheet ({total} selected)", "danger")
+        return redirect(url_for("files.dashboard"))
+
+    # Rows are read here, where the session lives; drawing a sheet of up to
+    # MAX_LABELS barcodes is CPU-bound and is offloaded so it doesn't stall
+    # the eventlet hub. The PDF is spooled to a temp file and streamed back,
+    # so memory stays flat however many pages the sheet runs to
+    labels = list(labels)
+    sheet = tempfile.TemporaryFile()
+    offload(write_label_sheet, sheet, labels)
+    sheet.seek(0)
+    return send_file(sheet, mimetype="application/pdf", download_name="file-labels.pdf")
+
+
+@bp.route("/transactions/<int:tx_id>/signature/<kind>")
+@login_required
+def transaction_signature(tx_id, kind):
+    from app.utils.signatures import KINDS, load_signature
+
+    owner = db.session.query(FileTransaction.user_id).filter(FileTransaction.id == tx_id).scalar()
+    if kind not in KINDS or owner is None:
+        abort(404)
+    if owner != current_user.id and not current_user.is_admin():
+        abort(403)
+
+    blob = load_signature(tx_id, kind)
+    if blob is None:
+        abort(404)
+    # Always served as an image, whatever was recorded before uploads were
+    # re-encoded, and never sniffed into anything a browser would run
+    response = current_app.response_class(blob.data, mimetype="image/png")
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["Content-Disposition"] = "inline"
+    response.set_etag(blob.sha256)
+    # A transaction's signature never changes once recorded
+    response.cache_control.private = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    return response.make_conditional(request)
+
+
 @bp.route("/files/scan/<file_number>")
 @login_required
 def scan_file(file_number):
@@ -314,7 +500,9 @@ def scan_file(file_number):
 @login_required
 def view_file(file_id):
     file = FileRecord.query.get_or_404(file_id)
-    return render_template("files/view_file.html", file=file)
+    version = latest_version(file.id)
+    preview = version.blob_sha256 if version and can_preview(version.content_type) else None
+    return render_template("files/view_file.html", file=file, preview=preview)
 
 
 
@@ -324,13 +512,146 @@ def view_file(file_id):
 @login_required
 def file_timeline(file_id):
     file = FileRecord.query.get_or_404(file_id)
-    transactions = file.transactions
-    return render_template("files/timeline.html", file=file, transactions=transactions)
+    page = file_history_page(file.id, limit=request.args.get('limit'))
+    return render_template("files/timeline.html", file=file, transactions=page.items, next_cursor=page.next_cursor)
+
+
+@bp.route("/files/<int:file_id>/timeline/events")
+@login_required
+def file_timeline_events(file_id):
+    """Older timeline entries for incremental loading, newest first."""
+    file = FileRecord.query.get_or_404(file_id)
+    try:
+        page = file_history_page(file.id, cursor=request.args.get('cursor'), limit=request.args.get('limit'))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    offset = request.args.get('offset', 0, type=int)
+    return jsonify({
+        "transactions": [serialize_transaction(tx) for tx in page.items],
+        "html": render_template("files/_timeline_items.html", transactions=page.items, offset=offset),
+        "next_cursor": page.next_cursor
+    })
+
+@bp.route("/files/<int:file_id>/report")
+@login_required
+def file_report(file_id):
+    """Movement report PDF; built in the background and cached until the file moves again."""
+    from app.utils.pdf_reports import request_file_report
+
+    file = FileRecord.query.get_or_404(file_id)
+    path, key = request_file_report(file)
+    if path is None:
+        response = current_app.response_class("The report is being generated, this page will refresh shortly.", status=202, mimetype="text/plain")
+        response.headers["Retry-After"] = "2"
+        response.headers["Refresh"] = "2"
+        return response
+    return send_file(
+        path,
+        mimetype="application/pdf",
+        download_name=f"file-report-{secure_filename(file.file_number)}.pdf",
+        etag=key,
+        conditional=True
+    )
+
+
+def latest_version(file_id):
+    return FileVersion.query.filter_by(file_id=file_id).order_by(FileVersion.id.desc()).first()
+
+
+def latest_versions(file_ids):
+    """Map each file id to its newest version with one query for a whole page."""
+    if not file_ids:
+        return {}
+    newest = db.session.query(func.max(FileVersion.id)).filter(
+        FileVersion.file_id.in_(file_ids)
+    ).group_by(FileVersion.file_id)
+    return {v.file_id: v for v in FileVersion.query.filter(FileVersion.id.in_(newest)).all()}
+
+
+@bp.route("/previews/<size>/<digest>.webp")
+@login_required
+def preview(size, digest):
+    if size not in PREVIEW_SIZES or not re.fullmatch(r"[0-9a-f]{64}", digest):
+        abort(404)
+    path = preview_path(digest, size)
+    if not os.path.exists(path):
+        # Documents stored before previews existed are rendered on first sight
+        schedule_previews(FileVersion.query.filter_by(blob_sha256=digest).limit(1).all())
+        abort(404)
+    return send_blob(preview_key(digest, size), PREVIEW_MIMETYPE, immutable=True, path=path)
+
+
+def add_version(file_record, uploaded_file, filename):
+    """Store an uploaded document and reference it as a new version.
+
+    Returns None when the content is identical to the current version, so
+    re-uploading the same scan does not create another copy or row.
+    """
+    digest, size = save_upload(uploaded_file)
+    return record_version(file_record, digest, size, filename, uploaded_file.mimetype)
+
+
+def record_version(file_record, digest, size, filename, content_type=None):
+    """Reference an already stored blob as the newest version of a file."""
+    current = latest_version(file_record.id) if file_record.id else None
+    if current and current.blob_sha256 == digest:
+        return None
+    version = FileVersion(
+        file=file_record,
+        blob_sha256=digest,
+        filename=filename,
+        content_type=content_type or guess_type(filename),
+        size=size,
+        uploaded_by_id=current_user.id
+    )
+    db.session.add(version)
+    return version
+
+
+@bp.route("/files/<int:file_id>/versions", methods=["POST"])
+@login_required
+def upload_version(file_id):
+    file = FileRecord.query.get_or_404(file_id)
+    uploaded_file = request.files.get("file")
+    if not uploaded_file:
+        flash("Choose a file to upload", "danger")
+        return redirect(url_for("files.view_file", file_id=file.id))
+
+    try:
+        version = add_version(file, uploaded_file, secure_filename(uploaded_file.filename))
+        if version is None:
+            flash("This document is identical to the current version", "info")
+            return redirect(url_for("files.view_file", file_id=file.id))
+        if not file.filename:
+            file.filename = version.filename
+        db.session.commit()
+        schedule_previews([version])
+
+        from app.utils.audit import log_action
+        log_action(f"New version of file {file.file_number} uploaded", event="file.version", file=file)
+        flash("New version uploaded", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Upload failed: {str(e)}", "danger")
+
+    return redirect(url_for("files.view_file", file_id=file.id))
+
 
 @bp.route('/download/<filename>')
 @login_required
 def download_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    file = FileRecord.query.filter_by(filename=filename).first()
+    version = latest_version(file.id) if file else None
+    if version is None:
+        # Uploads from before the blob store live directly in UPLOAD_FOLDER
+        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    return send_blob(
+        version.blob_sha256,
+        version.content_type,
+        as_attachment=True,
+        download_name=version.filename,
+        last_modified=version.created_at
+    )
 
 """@bp.route('/upload', methods=['POST'])
 @login_required
@@ -458,7 +779,8 @@ def upload():
         return redirect(url_for("files.dashboard"))
 
     # Check duplicate file number
-    if FileRecord.query.filter_by(file_number=form.file_number.data).first():
+    file_number = (form.file_number.data or "").strip()
+    if file_number and FileRecord.query.filter_by(file_number=file_number).first():
         flash("File number already exists", "danger")
         return redirect(url_for("files.dashboard"))
 
@@ -475,43 +797,30 @@ def upload():
             flash("A file with this filename already exists", "danger")
             return redirect(url_for("files.dashboard"))
 
-        upload_dir = current_app.config['UPLOAD_FOLDER']
-        file_path = os.path.join(upload_dir, filename)
-
-        # 🔒 Prevent duplicate filename in filesystem
-        if os.path.exists(file_path):
-            flash("A file with this name already exists on the server", "danger")
-            return redirect(url_for("files.dashboard"))
-
-    
-
     try:
+        # Blank file number: allocate the next one for the department
+        if not file_number:
+            from app.utils.file_numbering import generate_file_number
+            file_number = generate_file_number(form.department.data)
+
         # Create record FIRST
         file_record = FileRecord(
-            file_number=form.file_number.data,
+            file_number=file_number,
             name=form.name.data,
             department=form.department.data,
             filename=filename
         )
 
         db.session.add(file_record)
-        db.session.commit()
-
-        # Save file AFTER DB commit
-        if uploaded_file:
-            os.makedirs(upload_dir, exist_ok=True)
-            uploaded_file.save(file_path)
 
-            # Versioning
-            version_dir = os.path.join(upload_dir, 'versions', filename)
-            os.makedirs(version_dir, exist_ok=True)
+        # Stream the upload into the content-addressed store (hashed on the
+        # way to disk) and record it as the first version of the file
+        version = add_version(file_record, uploaded_file, filename) if uploaded_file else None
 
-            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            version_path = os.path.join(version_dir, f"{timestamp}_{filename}")
-            shutil.copy(file_path, version_path)
+        db.session.commit()
+        schedule_previews([version])
 
-        cache.delete_memoized(dashboard)
-        flash("File record created successfully", "success")
+        flash(f"File record {file_number} created successfully", "success")
 
     except Exception as e:
         db.session.rollback()
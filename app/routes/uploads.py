@@ -0,0 +1,254 @@
+from datetime import datetime, timedelta
+import fcntl
+import hashlib
+import os
+import threading
+import uuid
+from flask import Blueprint, request, jsonify, current_app, abort
+from flask_login import login_required, current_user
+from werkzeug.utils import secure_filename
+from app import db
+from app.models import UploadSession, FileRecord, ChatRoom, ChatMessage
+from app.utils.blob_store import temp_path, publish_temp, media_name, guess_type, CHUNK_SIZE
+
+bp = Blueprint("uploads", __name__)
+
+"""
+Resumable chunked upload protocol:
+
+    POST /uploads                      {"filename", "size", "content_type"} -> {"upload_id", "offset", "chunk_size"}
+    PUT  /uploads/<id>?offset=<n>      raw chunk bytes                      -> {"offset"}
+    GET  /uploads/<id>                                                      -> {"offset", "size"}  (resume point)
+    POST /uploads/<id>/finalize        {"file_id"} or {"room_id", "kind"}   -> stored blob details
+
+Chunks are streamed straight into a temp file inside the blob store, so
+memory use is bounded by CHUNK_SIZE whatever the file size, and a client
+that loses its connection asks for the offset and carries on from there.
+Each chunk is hashed as it is written, so finalize does not read the
+whole file back.
+"""
+
+MEDIA_FIELDS = {"image": "image_filename", "voice": "voice_filename", "video": "video_filename"}
+
+# Running sha256 per upload, {upload_id: (offset hashed up to, hasher)}.
+# hashlib state can't be persisted, so it lives with the worker that took
+# the last chunk; a chunk landing on another worker, or after a restart,
+# catches up by hashing the bytes already on disk once
+_hashers = {}
+_hashers_lock = threading.Lock()
+# Abandoned sessions are purged from the database by another process, so
+# bound what a worker keeps; an evicted upload just catches up again
+MAX_HASHERS = 1024
+
+
+def _hasher_at(upload_id, path, offset):
+    """A sha256 of the first ``offset`` bytes of the upload, ready to extend."""
+    with _hashers_lock:
+        entry = _hashers.pop(upload_id, None)
+    if entry is not None and entry[0] == offset:
+        return entry[1]
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(path, "rb") as f:
+        while remaining:
+            piece = f.read(min(CHUNK_SIZE, remaining))
+            if not piece:
+                break
+            hasher.update(piece)
+            remaining -= len(piece)
+    return hasher
+
+
+def _keep_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.pop(next(iter(_hashers)))
+
+
+def _drop_hasher(upload_id):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+
+
+def _get_session(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    if upload.user_id != current_user.id:
+        abort(404)
+    return upload
+
+
+def _discard(upload):
+    _drop_hasher(upload.id)
+    if os.path.exists(upload.temp_path):
+        os.remove(upload.temp_path)
+    db.session.delete(upload)
+
+
+@bp.route("", methods=["POST"])
+@login_required
+def init_upload():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get("filename") or "")
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        size = -1
+
+    if not filename:
+        return jsonify({"error": "filename is required"}), 400
+    if size < 0 or size > current_app.config["MAX_UPLOAD_SIZE"]:
+        return jsonify({"error": "size is missing or exceeds the upload limit"}), 400
+
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        filename=filename,
+        content_type=data.get("content_type") or guess_type(filename),
+        total_size=size,
+        received=0,
+        temp_path=temp_path()
+    )
+    db.session.add(upload)
+    db.session.commit()
+
+    return jsonify({
+        "upload_id": upload.id,
+        "offset": 0,
+        "chunk_size": current_app.config["UPLOAD_CHUNK_SIZE"]
+    }), 201
+
+
+@bp.route("/<upload_id>", methods=["GET"])
+@login_required
+def upload_status(upload_id):
+    upload = _get_session(upload_id)
+    return jsonify({"upload_id": upload.id, "offset": upload.received, "size": upload.total_size})
+
+
+@bp.route("/<upload_id>", methods=["PUT"])
+@login_required
+def put_chunk(upload_id):
+    upload = _get_session(upload_id)
+    offset = request.args.get("offset", type=int)
+    length = request.content_length
+
+    if offset != upload.received:
+        # Out of order or replayed chunk: tell the client where to resume
+        return jsonify({"error": "offset mismatch", "offset": upload.received}), 409
+    if length is None or length > current_app.config["UPLOAD_CHUNK_SIZE"]:
+        return jsonify({"error": "chunk missing Content-Length or too large"}), 413
+    if offset + length > upload.total_size:
+        return jsonify({"error": "chunk exceeds declared size", "offset": upload.received}), 400
+
+    with open(upload.temp_path, "r+b") as out:
+        # One writer per upload: the running hash must cover exactly the
+        # bytes that end up on disk. Non-blocking, so a duplicate request
+        # is refused instead of stalling the worker
+        try:
+            fcntl.flock(out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return jsonify({"error": "chunk already in progress", "offset": upload.received}), 409
+        db.session.refresh(upload)
+        if offset != upload.received:
+            return jsonify({"error": "offset mismatch", "offset": upload.received}), 409
+
+        hasher = _hasher_at(upload.id, upload.temp_path, offset)
+        written = 0
+        out.seek(offset)
+        while True:
+            piece = request.stream.read(min(CHUNK_SIZE, length - written))
+            if not piece:
+                break
+            out.write(piece)
+            hasher.update(piece)
+            written += len(piece)
+        out.truncate(offset + written)
+        out.flush()
+
+        # Conditional advance so two racing requests for the same offset can't both count
+        advanced = UploadSession.query.filter_by(id=upload.id, received=offset).update({
+            UploadSession.received: offset + written,
+            UploadSession.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if not advanced:
+            db.session.refresh(upload)
+            return jsonify({"error": "offset mismatch", "offset": upload.received}), 409
+        _keep_hasher(upload.id, offset + written, hasher)
+
+    return jsonify({"upload_id": upload.id, "offset": offset + written})
+
+
+@bp.route("/<upload_id>", methods=["DELETE"])
+@login_required
+def cancel_upload(upload_id):
+    _discard(_get_session(upload_id))
+    db.session.commit()
+    return "", 204
+
+
+@bp.route("/<upload_id>/finalize", methods=["POST"])
+@login_required
+def finalize_upload(upload_id):
+    upload = _get_session(upload_id)
+    if upload.received != upload.total_size:
+        return jsonify({"error": "upload incomplete", "offset": upload.received}), 409
+
+    data = request.get_json(silent=True) or {}
+    file_record = room = version = msg = None
+    if data.get("file_id"):
+        file_record = FileRecord.query.get_or_404(data["file_id"])
+    elif data.get("room_id"):
+        from app.routes.chat import can_access_chat
+        room = ChatRoom.query.get_or_404(data["room_id"])
+        if data.get("kind") not in MEDIA_FIELDS:
+            return jsonify({"error": "kind must be one of image, voice, video"}), 400
+        if not can_access_chat(current_user, room):
+            abort(403)
+
+    # The temp file outlives the blob until the commit below succeeds, so
+    # a finalize that fails on the database can simply be retried
+    hasher = _hasher_at(upload.id, upload.temp_path, upload.total_size)
+    _keep_hasher(upload.id, upload.total_size, hasher)
+    digest = hasher.hexdigest()
+    publish_temp(upload.temp_path, digest)
+    result = {"sha256": digest, "size": upload.total_size, "media_name": media_name(digest, upload.filename)}
+
+    if file_record is not None:
+        from app.routes.files import record_version
+        version = record_version(file_record, digest, upload.total_size, upload.filename, upload.content_type)
+        if version is not None and not file_record.filename:
+            file_record.filename = upload.filename
+        result["version_created"] = version is not None
+    elif room is not None:
+        msg = ChatMessage(room_id=room.id, sender_id=current_user.id, message=data.get("message") or None)
+        setattr(msg, MEDIA_FIELDS[data["kind"]], result["media_name"])
+        db.session.add(msg)
+        db.session.flush()
+        result["message_id"] = msg.id
+
+    temp = upload.temp_path
+    db.session.delete(upload)
+    db.session.commit()
+    _drop_hasher(upload_id)
+    if os.path.exists(temp):
+        os.remove(temp)
+    if version is not None:
+        from app.utils.previews import schedule_previews
+        schedule_previews([version])
+    if msg is not None:
+        from app.chat_socket import emit_new_message
+        emit_new_message(msg, current_user)
+    return jsonify(result), 201
+
+
+def purge_stale_uploads(max_age_hours=None):
+    """Remove upload sessions (and their partial files) idle longer than the TTL."""
+    hours = current_app.config["UPLOAD_SESSION_TTL_HOURS"] if max_age_hours is None else max_age_hours
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for upload in stale:
+        _discard(upload)
+    db.session.commit()
+    return len(stale)
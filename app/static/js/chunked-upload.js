@@ -0,0 +1,68 @@
+/**
+ * Resumable chunked uploads for FTS
+ * Talks to the /uploads init / chunk / finalize protocol (routes/uploads.py)
+ */
+
+async function uploadJson(url, method, body) {
+    const response = await fetch(url, {
+        method: method,
+        credentials: 'same-origin',
+        headers: { 'Content-Type': 'application/json' },
+        body: body ? JSON.stringify(body) : undefined
+    });
+    const data = await response.json().catch(() => ({}));
+    return { ok: response.ok, status: response.status, data: data };
+}
+
+/**
+ * Upload a File/Blob in chunks, resuming from the server's offset after
+ * network errors. `attach` is sent on finalize, e.g. {file_id: 12} or
+ * {room_id: 3, kind: 'video'}. `onProgress(sent, total)` is optional.
+ */
+async function chunkedUpload(file, attach = {}, onProgress = null, maxRetries = 5) {
+    const init = await uploadJson('/uploads', 'POST', {
+        filename: file.name || 'upload.bin',
+        size: file.size,
+        content_type: file.type
+    });
+    if (!init.ok) throw new Error(init.data.error || 'Could not start upload');
+
+    const uploadId = init.data.upload_id;
+    const chunkSize = init.data.chunk_size;
+    let offset = init.data.offset;
+    let retries = 0;
+
+    while (offset < file.size) {
+        const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+        try {
+            const response = await fetch(`/uploads/${uploadId}?offset=${offset}`, {
+                method: 'PUT',
+                credentials: 'same-origin',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: chunk
+            });
+            const data = await response.json();
+            if (response.ok || response.status === 409) {
+                if (response.status === 409 && data.offset === offset) {
+                    // An earlier attempt at this chunk is still being written
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                }
+                offset = data.offset;
+                retries = 0;
+                if (onProgress) onProgress(offset, file.size);
+                continue;
+            }
+            throw new Error(data.error || `Chunk failed with status ${response.status}`);
+        } catch (error) {
+            if (++retries > maxRetries) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            // Ask the server how much it actually has before retrying
+            const status = await uploadJson(`/uploads/${uploadId}`, 'GET').catch(() => null);
+            if (status && status.ok) offset = status.data.offset;
+        }
+    }
+
+    const done = await uploadJson(`/uploads/${uploadId}/finalize`, 'POST', attach);
+    if (!done.ok) throw new Error(done.data.error || 'Could not finalize upload');
+    return done.data;
+}
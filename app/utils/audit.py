@@ -1,11 +1,342 @@
-from app import db
-from app.models import AuditLog
+import atexit
+import csv
+import io
+import queue
+import re
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
 from flask_login import current_user
+from sqlalchemy import false, func, inspect, insert, select
+from app import db
+from app.models import AuditLog, FileRecord, User
+from app.utils.pagination import keyset_paginate
+
+# Action types recorded in audit_log.event
+EVENTS = (
+    "file.checkout",
+    "file.return",
+    "file.version",
+    "files.import",
+)
+ARCHIVE_PREFIX = "audit_log_"
+EXPORT_BATCH_SIZE = 2000
+EXPORT_COLUMNS = ("id", "timestamp", "event", "action", "user_id", "actor", "file_id", "file_number")
+# Longest wait between attempts to write a batch the database refused
+RETRY_MAX_SECONDS = 60
+
+
+class AuditWriter:
+    """Buffers audit entries in memory and writes them in batched inserts.
+
+    A single daemon thread drains the queue every ``flush_seconds`` or as
+    soon as ``batch_size`` entries are waiting, using its own connection so
+    request transactions are never touched. A batch the database refuses is
+    kept and retried with exponential backoff ahead of anything newer, while
+    new entries wait in the queue. The queue is bounded: when it is full the
+    caller writes the backlog itself rather than dropping entries. Pending
+    entries are flushed at interpreter exit; only what still cannot be
+    written then is dropped, and logged.
+    """
+
+    def __init__(self, app, batch_size=200, flush_seconds=1.0, max_queue=10000):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._write_lock = threading.Lock()
+        # Batch whose write failed, written before anything else; guarded by _write_lock
+        self._failed = []
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.flush()
+            self.queue.put_nowait(entry)
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(insert(AuditLog.__table__), batch)
+
+    def _write_next(self, first=None):
+        """Write the failed batch, or else the next one; returns its size.
+
+        Call with _write_lock held. A batch that fails to write is kept for
+        the next attempt and the error is raised.
+        """
+        batch, self._failed = self._failed, []
+        if not batch:
+            batch = self._drain(first)
+        elif first is not None:
+            batch.append(first)
+        if batch:
+            try:
+                self._write(batch)
+            except Exception:
+                self._failed = batch
+                raise
+        return len(batch)
+
+    def flush(self):
+        """Write everything queued so far; blocks until it is stored."""
+        # The lock also waits out a batch the writer thread already took
+        with self._write_lock:
+            while self._write_next():
+                pass
+
+    def _run(self):
+        failures = 0
+        while not self._stopping.is_set():
+            first = None
+            if not self._failed:
+                try:
+                    first = self.queue.get(timeout=self.flush_seconds)
+                except queue.Empty:
+                    continue
+            with self._write_lock:
+                try:
+                    self._write_next(first)
+                    failures = 0
+                except Exception:
+                    failures += 1
+                    delay = min(self.flush_seconds * 2 ** failures, RETRY_MAX_SECONDS)
+                    self.app.logger.exception(
+                        "Could not write %d audit entries; retrying in %.0fs", len(self._failed), delay
+                    )
+            if failures:
+                # Woken early by stop(), which makes the last attempt itself
+                self._stopping.wait(delay)
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join(timeout=self.flush_seconds * 2)
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception(
+                "Dropped %d audit entries at shutdown", len(self._failed) + self.queue.qsize()
+            )
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = current_app.config
+                _writer = AuditWriter(
+                    current_app._get_current_object(),
+                    batch_size=config["AUDIT_BATCH_SIZE"],
+                    flush_seconds=config["AUDIT_FLUSH_SECONDS"],
+                    max_queue=config["AUDIT_QUEUE_SIZE"],
+                )
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def flush_audit_log():
+    if _writer is not None:
+        _writer.flush()
+
+
+def log_action(action, commit=True, event=None, file=None, user=None):
+    """Record an audit entry.
+
+    ``event`` is the action type (one of EVENTS), ``file`` the target
+    FileRecord or id and ``user`` the actor, defaulting to the current user.
+
+    With ``commit=False`` the entry joins the caller's transaction and is
+    stored by the caller's commit, atomically with the change it describes.
+    Otherwise it is handed to the buffered writer (or written straight away
+    when AUDIT_ASYNC is off) and the caller never waits on a second commit.
+    """
+    if user is None and current_user.is_authenticated:
+        user = current_user
+    entry = {
+        "action": action,
+        "event": event,
+        "user_id": getattr(user, "id", user),
+        "file_id": getattr(file, "id", file),
+        "timestamp": datetime.utcnow(),
+    }
+    if not commit:
+        db.session.add(AuditLog(**entry))
+    elif current_app.config["AUDIT_ASYNC"]:
+        get_writer().put(entry)
+    else:
+        db.session.add(AuditLog(**entry))
+        db.session.commit()
+
 
-def log_action(action):
-    log = AuditLog(
-        action=action,
-        user_id=current_user.id if current_user.is_authenticated else None
+def _month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(value):
+    return _month_start(_month_start(value) + timedelta(days=32))
+
+
+_archive_metadata = db.MetaData()
+
+
+def archive_table(month):
+    """The audit_log_YYYYMM table for ``month`` (a "YYYYMM" string)."""
+    name = f"{ARCHIVE_PREFIX}{month}"
+    table = _archive_metadata.tables.get(name)
+    if table is None:
+        # Same columns and indexes as audit_log; no foreign keys, so archived
+        # history never blocks changes to users or files
+        columns = [db.Column(c.name, c.type, primary_key=c.primary_key) for c in AuditLog.__table__.columns]
+        indexes = [
+            db.Index(f"ix_{name}{index.name[len('ix_audit_log'):]}", *[c.name for c in index.columns])
+            for index in AuditLog.__table__.indexes
+        ]
+        table = db.Table(name, _archive_metadata, *columns, *indexes)
+    return table
+
+
+def archived_months():
+    """Months with an archive table, newest first."""
+    pattern = re.compile(rf"^{ARCHIVE_PREFIX}(\d{{6}})$")
+    names = inspect(db.engine).get_table_names()
+    return sorted((m.group(1) for m in map(pattern.match, names) if m), reverse=True)
+
+
+def archive_audit_log(before=None):
+    """Move entries older than ``before`` into monthly archive tables.
+
+    ``before`` defaults to the start of the month AUDIT_RETENTION_MONTHS ago,
+    which keeps audit_log (and its indexes) sized to recent activity. Each
+    month is copied and deleted in one transaction with INSERT ... SELECT,
+    so no rows pass through Python. Returns the number of entries moved.
+    """
+    if before is None:
+        before = _month_start(datetime.utcnow())
+        for _ in range(current_app.config["AUDIT_RETENTION_MONTHS"]):
+            before = _month_start(before - timedelta(days=1))
+
+    live = AuditLog.__table__
+    moved = 0
+    while True:
+        oldest = db.session.query(func.min(live.c.timestamp)).filter(live.c.timestamp < before).scalar()
+        if oldest is None:
+            break
+        start = _month_start(oldest)
+        end = min(_next_month(start), before)
+        table = archive_table(f"{start:%Y%m}")
+        in_month = (live.c.timestamp >= start) & (live.c.timestamp < end)
+
+        conn = db.session.connection()
+        table.create(conn, checkfirst=True)
+        names = [c.name for c in live.columns]
+        conn.execute(table.insert().from_select(names, select(*live.columns).where(in_month)))
+        moved += conn.execute(live.delete().where(in_month)).rowcount
+        db.session.commit()
+    return moved
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+
+def audit_params(args):
+    """Normalise audit log query-string arguments into a filter dict."""
+    try:
+        user_id = int(args.get("user_id")) if args.get("user_id") else None
+    except ValueError:
+        user_id = None
+    month = (args.get("month") or "").strip()
+    until = _parse_date(args.get("until"))
+    return {
+        "event": args.get("event") if args.get("event") in EVENTS else None,
+        "user_id": user_id,
+        "file_number": (args.get("file_number") or "").strip() or None,
+        "since": _parse_date(args.get("since")),
+        # Inclusive of the whole "until" day
+        "until": until + timedelta(days=1) if until else None,
+        "month": month if month in archived_months() else None,
+    }
+
+
+def audit_query(params):
+    """Entries matching ``params`` as rows with the actor's name and file number.
+
+    Reads audit_log, or the archive table for ``params["month"]``.
+    """
+    table = archive_table(params["month"]) if params["month"] else AuditLog.__table__
+    query = db.session.query(
+        *table.c, User.name.label("actor"), FileRecord.file_number
+    ).outerjoin(User, User.id == table.c.user_id).outerjoin(FileRecord, FileRecord.id == table.c.file_id)
+
+    if params["event"]:
+        query = query.filter(table.c.event == params["event"])
+    if params["user_id"] is not None:
+        query = query.filter(table.c.user_id == params["user_id"])
+    if params["file_number"]:
+        # Resolve to an id first so the (file_id, timestamp) index is used
+        file_id = db.session.query(FileRecord.id).filter_by(file_number=params["file_number"]).scalar()
+        query = query.filter(table.c.file_id == file_id if file_id is not None else false())
+    if params["since"]:
+        query = query.filter(table.c.timestamp >= params["since"])
+    if params["until"]:
+        query = query.filter(table.c.timestamp < params["until"])
+    return query, table
+
+
+def audit_page(params, cursor=None, limit=None):
+    """One newest-first keyset page of audit entries matching ``params``."""
+    query, table = audit_query(params)
+    return keyset_paginate(
+        query,
+        [table.c.timestamp, table.c.id],
+        cursor=cursor,
+        limit=limit,
+        descending=True,
+        key=lambda row: [row.timestamp, row.id],
     )
-    db.session.add(log)
-    db.session.commit()
+
+
+def iter_audit_csv(params, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the entries matching ``params`` as CSV text, one chunk per batch.
+
+    Batches are keyset pages, so memory stays flat and no cursor is held
+    open between chunks however many rows are exported.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    cursor = None
+    while True:
+        page = audit_page(params, cursor=cursor, limit=batch_size)
+        for row in page:
+            writer.writerow([
+                row.id, row.timestamp.isoformat(sep=" ") if row.timestamp else "", row.event or "",
+                row.action or "", row.user_id or "", row.actor or "", row.file_id or "", row.file_number or "",
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
@@ -0,0 +1,56 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = current_app.config.get("BACKGROUND_WORKERS", 2)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background")
+    return _executor
+
+
+def offload(func, *args):
+    """Run CPU-bound ``func`` on a real OS thread when running under eventlet.
+
+    Under the eventlet worker pool threads are green, so rendering would
+    otherwise block the hub and every socket connection with it.
+    """
+    patcher = sys.modules.get("eventlet.patcher")
+    if patcher is not None and patcher.is_monkey_patched("thread"):
+        from eventlet import tpool
+        return tpool.execute(func, *args)
+    return func(*args)
+
+
+def _run(app, key, func, args):
+    try:
+        with app.app_context():
+            func(*args)
+    except Exception:
+        app.logger.exception("Background job %s failed", key)
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+
+def submit(key, func, *args):
+    """Queue ``func(*args)`` on the shared worker pool inside an app context.
+
+    Jobs are de-duplicated by ``key`` while queued or running. Returns False
+    when an identical job is already in flight.
+    """
+    with _lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+    app = current_app._get_current_object()
+    _get_executor().submit(_run, app, key, func, args)
+    return True
+
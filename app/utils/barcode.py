@@ -1,13 +1,117 @@
+import hashlib
+import io
+from functools import lru_cache
 from barcode import Code128
-from barcode.writer import ImageWriter
-
-def generate_file_barcode(file_number):
-    barcode = Code128(file_number, writer=ImageWriter())
-    path = f"app/static/barcodes/{file_number}"
-    barcode.save(path)
-    
+from barcode.writer import ImageWriter, SVGWriter
 import qrcode
+import qrcode.image.svg
+
+KINDS = ("barcode", "qr")
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+# Bump when rendering options change so clients drop their cached copies
+RENDER_VERSION = 1
+CACHE_SIZE = 2048
+
+# A4 sheet of 3 x 8 labels, 70 x 37 mm (the common L7159 layout)
+LABEL_COLUMNS = 3
+LABEL_ROWS = 8
+MAX_LABELS = 5000
+
+
+def code_etag(kind, value, fmt):
+    # Known before rendering, so a revalidation never touches the renderer
+    key = f"{kind}:{fmt}:{RENDER_VERSION}:{value}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def render_code(kind, value, fmt="png"):
+    """Render a barcode or QR code for ``value`` in memory and return the bytes.
+
+    Results are kept in a bounded LRU cache: label printing and scanner
+    screens request the same few codes repeatedly, and nothing is written
+    to disk.
+    """
+    buf = io.BytesIO()
+    if kind == "barcode":
+        writer = ImageWriter() if fmt == "png" else SVGWriter()
+        Code128(value, writer=writer).write(buf, {"module_height": 10.0, "quiet_zone": 2.0, "font_size": 8})
+    elif fmt == "png":
+        qrcode.make(value, box_size=6, border=2).save(buf)
+    else:
+        qrcode.make(value, image_factory=qrcode.image.svg.SvgPathImage, box_size=6, border=2).save(buf)
+    return buf.getvalue()
+
+
+def _draw_qr(c, value, x, y, size):
+    # One filled path of horizontal runs; far cheaper than a shape per module.
+    # A fixed mask skips scoring all eight patterns, which dominates encoding
+    code = qrcode.QRCode(border=0, error_correction=qrcode.constants.ERROR_CORRECT_M, mask_pattern=0)
+    code.add_data(value)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    module = size / len(matrix)
+    path = c.beginPath()
+    for row, cells in enumerate(matrix):
+        top = y + size - (row + 1) * module
+        col = 0
+        while col < len(cells):
+            if cells[col]:
+                start = col
+                while col < len(cells) and cells[col]:
+                    col += 1
+                path.rect(x + start * module, top, (col - start) * module, module)
+            col += 1
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def write_label_sheet(out, labels):
+    """Draw printable labels for ``labels`` as a multi-page PDF into ``out``.
+
+    ``labels`` is any iterable of ``(file_number, name)`` pairs and is
+    consumed lazily. Barcodes and QR codes are drawn as vector shapes, so no
+    intermediate images are produced.
+    """
+    from reportlab.graphics.barcode import code128
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
+    page_width, page_height = A4
+    label_width, label_height = 70 * mm, 37 * mm
+    margin_x = (page_width - LABEL_COLUMNS * label_width) / 2
+    margin_y = (page_height - LABEL_ROWS * label_height) / 2
+    qr_size = 18 * mm
+
+    c = canvas.Canvas(out, pagesize=A4, pageCompression=1)
+    c.setTitle("File labels")
+    per_page = LABEL_COLUMNS * LABEL_ROWS
+    count = 0
+    for file_number, name in labels:
+        slot = count % per_page
+        if count and slot == 0:
+            c.showPage()
+        count += 1
+
+        x = margin_x + (slot % LABEL_COLUMNS) * label_width + 3 * mm
+        y = page_height - margin_y - (slot // LABEL_COLUMNS + 1) * label_height + 3 * mm
+
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(x, y + 27 * mm, file_number)
+        c.setFont("Helvetica", 7)
+        c.drawString(x, y + 23 * mm, (name or "")[:40])
+
+        # Narrow the bars until the barcode fits beside the QR code
+        available = label_width - qr_size - 10 * mm
+        bar_width = 0.33 * mm
+        barcode = code128.Code128(file_number, barHeight=11 * mm, barWidth=bar_width, quiet=False)
+        if barcode.width > available:
+            barcode = code128.Code128(file_number, barHeight=11 * mm, barWidth=bar_width * available / barcode.width, quiet=False)
+        barcode.drawOn(c, x, y + 5 * mm)
+
+        _draw_qr(c, file_number, x + label_width - qr_size - 6 * mm, y + 3 * mm, qr_size)
 
-def generate_file_qr(file):
-    img = qrcode.make(file.file_number)
-    img.save(f"app/static/qrcodes/{file.file_number}.png")
+    if not count:
+        c.drawString(margin_x, page_height - margin_y, "No files selected")
+    c.save()
+    return count
@@ -0,0 +1,97 @@
+from app import db
+from app.models import FileRecord, FileTransaction
+from app.utils.loans import open_loans, issue_file, close_loan
+
+MAX_BATCH_SIZE = 500
+ACTIONS = ("checkout", "return")
+
+
+def _normalise(file_numbers):
+    """Strip blanks and split repeated scans of the same barcode."""
+    # A bare string would otherwise be scanned one character at a time
+    if not isinstance(file_numbers, (list, tuple)):
+        raise ValueError("file_numbers must be a list of file numbers")
+    unique, duplicates = [], []
+    seen = set()
+    for number in file_numbers:
+        number = str(number).strip()
+        if not number:
+            continue
+        if number in seen:
+            duplicates.append(number)
+        else:
+            seen.add(number)
+            unique.append(number)
+    return unique, duplicates
+
+
+def apply_batch(action, file_numbers, user, purpose=None, comments=None, condition="good"):
+    """Check out or return a stream of scanned file numbers in one transaction.
+
+    Files and their open loans are resolved with one ``IN`` query each, every
+    valid item is applied, and the batch is committed once. Items that cannot
+    be applied are reported rather than failing the whole handover.
+    Returns ``(results, summary)`` where ``results`` has one entry per scan.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown batch action: {action}")
+
+    numbers, duplicates = _normalise(file_numbers)
+    if len(numbers) > MAX_BATCH_SIZE:
+        raise ValueError(f"A batch may contain at most {MAX_BATCH_SIZE} files")
+    if action == "checkout" and not (isinstance(purpose, str) and purpose.strip()):
+        raise ValueError("A purpose is required to check out files")
+
+    files = {f.file_number: f for f in FileRecord.query.filter(FileRecord.file_number.in_(numbers)).all()} if numbers else {}
+    loans = {}
+    if action == "return" and files:
+        loans = {tx.file_id: tx for tx in open_loans().filter(
+            FileTransaction.file_id.in_([f.id for f in files.values()])
+        ).all()}
+
+    results = []
+    applied = []
+    for number in numbers:
+        file = files.get(number)
+        if file is None:
+            results.append({"file_number": number, "ok": False, "message": "File not found"})
+            continue
+
+        if action == "checkout":
+            tx = None if file.is_issued else issue_file(file, user.id, purpose=purpose)
+            if tx is None:
+                results.append({"file_number": number, "ok": False, "message": "File is already checked out"})
+                continue
+        else:
+            tx = loans.get(file.id)
+            if tx is None:
+                results.append({"file_number": number, "ok": False, "message": "File is not currently checked out"})
+                continue
+            close_loan(tx, comments=comments, condition=condition or "good", returned_to_admin_id=user.id)
+
+        applied.append((file, tx))
+        results.append({"file_number": number, "ok": True, "message": "Checked out" if action == "checkout" else "Returned"})
+
+    results += [{"file_number": n, "ok": False, "message": "Duplicate scan ignored"} for n in duplicates]
+
+    if applied:
+        from app.utils.audit import log_action
+        verb = "checked out by" if action == "checkout" else "returned to"
+        for file, _ in applied:
+            log_action(f"File {file.file_number} {verb} {user.name} (batch)", commit=False,
+                       event=f"file.{action}", file=file, user=user)
+        try:
+            db.session.flush()
+            # Read before the commit expires them
+            items = [{"tx_id": tx.id, "file_number": file.file_number} for file, tx in applied]
+            user_name = user.name
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        from app.chat_socket import emit_batch_update
+        emit_batch_update(action, user_name, items)
+
+    summary = {"action": action, "applied": len(applied), "failed": len(results) - len(applied)}
+    return results, summary
@@ -0,0 +1,111 @@
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+CHUNK_SIZE = 64 * 1024
+
+# Chat media columns hold "<sha256><ext>" references into the store
+_MEDIA_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]{1,10})?$")
+
+
+def store_root():
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], "blobs")
+
+
+def blob_path(digest):
+    # Two levels of sharding keep directories small: blobs/ab/cd/abcd...
+    return os.path.join(store_root(), digest[:2], digest[2:4], digest)
+
+
+def temp_path():
+    """Create an empty temp file inside the store, on the same filesystem as the blobs."""
+    tmp_dir = os.path.join(store_root(), "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=tmp_dir)
+    os.close(fd)
+    return path
+
+
+def commit_temp(path, digest):
+    """Move a fully written temp file into place, or drop it if the blob already exists."""
+    target = blob_path(digest)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    return target
+
+
+def publish_temp(path, digest):
+    """Make the blob for ``digest`` from a temp file, leaving the temp file in place.
+
+    For callers that must record the blob in the database before they can
+    let go of the temp file: a failed commit can be retried, and a blob that
+    ends up unreferenced is harmless. Returns the blob path.
+    """
+    target = blob_path(digest)
+    if os.path.exists(target):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        # No hard links on this filesystem: copy, then move into place atomically
+        copy = temp_path()
+        shutil.copyfile(path, copy)
+        os.replace(copy, target)
+    return target
+
+
+def save_stream(stream):
+    """Copy ``stream`` into the store, hashing as it is written.
+
+    The upload is read once in fixed-size chunks, so memory stays bounded
+    and no second full-file copy is made. Identical content is stored once.
+    Returns ``(sha256_hex, size)``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    path = temp_path()
+    try:
+        with open(path, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        commit_temp(path, digest.hexdigest())
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return digest.hexdigest(), size
+
+
+def save_upload(file_storage):
+    return save_stream(file_storage.stream)
+
+
+def guess_type(filename):
+    return mimetypes.guess_type(filename or "")[0] or "application/octet-stream"
+
+
+def media_name(digest, original_filename):
+    ext = os.path.splitext(secure_filename(original_filename or ""))[1].lower()
+    return f"{digest}{ext}"
+
+
+def media_digest(name):
+    """Return the blob digest for a chat media reference, or None for legacy filenames."""
+    match = _MEDIA_NAME.match(name or "")
+    return match.group(1) if match else None
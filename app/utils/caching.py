@@ -0,0 +1,130 @@
+import functools
+import hashlib
+import uuid
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app import cache
+
+# Tables whose writes invalidate each namespace
+NAMESPACE_TABLES = {
+    "files": ("files", "file_versions", "departments"),
+    "transactions": ("file_transactions", "transaction_signatures"),
+    "chat": ("chat_rooms", "chat_room_members", "chat_messages"),
+    "users": ("users",),
+    "rollups": ("daily_activity", "rollup_watermarks"),
+    # Every user's room access at once; memberships and loans invalidate
+    # only the users involved (see utils/chat.py)
+    "access": ("chat_rooms",),
+}
+# Columns no cached value reads: read markers and unread counters move on
+# every room view, and must not invalidate the whole namespace
+UNTRACKED_COLUMNS = {"chat_room_members": {"last_read_at", "unread_count"}}
+_TABLE_NAMESPACES = {}
+for _ns, _tables in NAMESPACE_TABLES.items():
+    for _table in _tables:
+        _TABLE_NAMESPACES.setdefault(_table, set()).add(_ns)
+_PENDING = "cache_namespaces"
+
+
+def _version_key(namespace):
+    return f"ns:{namespace}"
+
+
+def _new_version():
+    # Random rather than a counter: if a version key is evicted, a restarted
+    # counter could reissue an old version and resurrect stale entries
+    return uuid.uuid4().hex[:12]
+
+
+def namespace_versions(namespaces):
+    keys = [_version_key(ns) for ns in namespaces]
+    versions = list(cache.get_many(*keys))
+    for i, version in enumerate(versions):
+        if version is None:
+            # add() only succeeds for the first worker; everyone uses its value
+            cache.add(keys[i], _new_version(), timeout=0)
+            versions[i] = cache.get(keys[i]) or _new_version()
+    return versions
+
+
+def bump(*namespaces):
+    """Invalidate every cached value that depends on ``namespaces``."""
+    cache.set_many({_version_key(ns): _new_version() for ns in namespaces}, timeout=0)
+
+
+def cached(*namespaces, timeout=None):
+    """Memoize a function in the shared cache until one of ``namespaces`` changes.
+
+    The key combines the function, its arguments and the current version of
+    each namespace, so a write bumps the version and every worker misses on
+    its next read; superseded entries simply expire. Arguments must have a
+    stable ``repr`` and results must be picklable and not None.
+    """
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            versions = ".".join(namespace_versions(namespaces))
+            digest = hashlib.sha1(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+            key = f"{name}:{versions}:{digest}"
+            value = cache.get(key)
+            if value is None:
+                value = func(*args, **kwargs)
+                cache.set(key, value, timeout=timeout)
+            return value
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def _touch(session, tables):
+    namespaces = set().union(*[_TABLE_NAMESPACES.get(t, ()) for t in tables])
+    if namespaces:
+        session.info.setdefault(_PENDING, set()).update(namespaces)
+
+
+def changed_columns(obj):
+    """Names of the attributes of a dirty ``obj`` with pending changes."""
+    return {attr.key for attr in inspect(obj).attrs if attr.history.has_changes()}
+
+
+def _tracked_change(obj):
+    table = getattr(obj, "__table__", None)
+    untracked = UNTRACKED_COLUMNS.get(table.name) if table is not None else None
+    return not untracked or not changed_columns(obj) <= untracked
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    _touch(session, {
+        obj.__table__.name
+        for obj in chain(session.new, session.deleted, filter(_tracked_change, session.dirty))
+        if hasattr(obj, "__table__")
+    })
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(state):
+    # Bulk insert()/update()/delete() and Query.update() bypass the flush
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None:
+            _touch(state.session, {table.name})
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    namespaces = session.info.pop(_PENDING, None)
+    if namespaces:
+        bump(*namespaces)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    # Only when the whole transaction is gone; a failed savepoint keeps the
+    # outer transaction's writes
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING, None)
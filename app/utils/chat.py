@@ -0,0 +1,144 @@
+from collections import namedtuple
+from itertools import chain
+from sqlalchemy import event, func, inspect, select, union
+from sqlalchemy.orm import Session, joinedload
+from app import cache, db
+from app.models import ChatMessage, ChatRoom, ChatRoomMember, FileRecord, FileTransaction
+from app.utils.caching import bump, cached, changed_columns, namespace_versions
+from app.utils.pagination import encode_cursor, keyset_paginate, page_size
+
+RoomSummary = namedtuple(
+    "RoomSummary",
+    "id name is_private created_at file_id file_filename member_count message_count",
+)
+
+
+@cached("chat", "files")
+def room_summaries():
+    """Every chat room with its member and message counts, from three grouped queries."""
+    members = dict(db.session.query(ChatRoomMember.room_id, func.count()).group_by(ChatRoomMember.room_id).all())
+    messages = dict(db.session.query(ChatMessage.room_id, func.count()).group_by(ChatMessage.room_id).all())
+    rooms = db.session.query(ChatRoom, FileRecord.filename) \
+        .outerjoin(FileRecord, FileRecord.id == ChatRoom.file_id) \
+        .order_by(ChatRoom.id).all()
+    return [
+        RoomSummary(
+            room.id, room.name, bool(room.is_private), room.created_at, room.file_id, filename,
+            members.get(room.id, 0), messages.get(room.id, 0),
+        )
+        for room, filename in rooms
+    ]
+
+
+_PENDING = "access_users"
+_PENDING_ALL = "access_all"
+# Columns that decide who can open a room
+_ACCESS_COLUMNS = {
+    ChatRoomMember: {"room_id", "user_id"},
+    FileTransaction: {"file_id", "user_id", "return_time"},
+}
+
+
+def _access_key(user_id):
+    # "access" moves with the rooms themselves, "access:<id>" with this
+    # user's memberships and loans
+    versions = ".".join(namespace_versions(("access", f"access:{user_id}")))
+    return f"access:{versions}:{user_id}"
+
+
+def _member_or_holder_rooms(user_id):
+    key = _access_key(user_id)
+    rooms = cache.get(key)
+    if rooms is None:
+        memberships = select(ChatRoomMember.room_id).where(ChatRoomMember.user_id == user_id)
+        held = select(ChatRoom.id) \
+            .join(FileTransaction, FileTransaction.file_id == ChatRoom.file_id) \
+            .where(FileTransaction.user_id == user_id, FileTransaction.return_time.is_(None))
+        rooms = frozenset(db.session.execute(union(memberships, held)).scalars())
+        cache.set(key, rooms)
+    return rooms
+
+
+def accessible_room_ids(user):
+    """Ids of the rooms ``user`` may open, or None for admins (every room).
+
+    Memberships and rooms linked to a file the user holds come from one
+    UNION query, cached per user. A membership or loan change drops only the
+    cached set of the member or borrower involved; a room change drops all.
+    """
+    if user.is_admin():
+        return None
+    return _member_or_holder_rooms(user.id)
+
+
+def can_access_room(user, room_id):
+    rooms = accessible_room_ids(user)
+    return rooms is None or room_id in rooms
+
+
+def message_page(room_id, before=None, after=None, limit=None):
+    """One page of a room's messages, oldest first, senders loaded in the same query.
+
+    By default the latest page; with ``before`` the page older than that
+    cursor, with ``after`` the messages newer than it. Served by
+    ix_chat_messages_room_time. Returns ``(messages, older_cursor,
+    newer_cursor)``: ``older_cursor`` is set while older history remains,
+    ``newer_cursor`` marks the newest message returned, to catch up from.
+    Raises ValueError for a malformed cursor.
+    """
+    query = ChatMessage.query.filter(ChatMessage.room_id == room_id) \
+        .options(joinedload(ChatMessage.sender))
+    columns = [ChatMessage.timestamp, ChatMessage.id]
+    limit = page_size(limit)
+
+    if after:
+        page = keyset_paginate(query, columns, cursor=after, limit=limit)
+        messages, older = page.items, None
+    else:
+        page = keyset_paginate(query, columns, cursor=before, limit=limit, descending=True)
+        messages, older = page.items[::-1], page.next_cursor
+    newer = encode_cursor([messages[-1].timestamp, messages[-1].id]) if messages else after
+    return messages, older, newer
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    users = set()
+    dirty = [
+        obj for obj in session.dirty
+        if type(obj) in _ACCESS_COLUMNS and _ACCESS_COLUMNS[type(obj)] & changed_columns(obj)
+    ]
+    for obj in chain(session.new, session.deleted, dirty):
+        if type(obj) not in _ACCESS_COLUMNS:
+            continue
+        users.add(obj.user_id)
+        # A row handed to another user changes both users' access
+        users.update(v for v in inspect(obj).attrs.user_id.history.deleted if v is not None)
+    if users:
+        session.info.setdefault(_PENDING, set()).update(users)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(state):
+    # Bulk statements (e.g. deleting a room's members) don't say whose
+    # access changed, so they drop every cached set
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None and table.name in ("chat_room_members", "file_transactions"):
+            state.session.info[_PENDING_ALL] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    users = session.info.pop(_PENDING, None)
+    if session.info.pop(_PENDING_ALL, False):
+        bump("access")
+    elif users:
+        bump(*[f"access:{user_id}" for user_id in users])
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING, None)
+        session.info.pop(_PENDING_ALL, None)
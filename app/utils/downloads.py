@@ -0,0 +1,57 @@
+import os
+from flask import current_app, request, send_file
+from app.utils.blob_store import blob_path, store_root
+
+# Content-addressed URLs never change meaning, so browsers may keep them forever
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _accel_response(path, digest, mimetype, as_attachment, download_name, last_modified):
+    """Hand the transfer to nginx: it serves the internal location, we only send headers."""
+    response = current_app.response_class(mimetype=mimetype)
+    relative = os.path.relpath(path, store_root()).replace(os.sep, "/")
+    response.headers["X-Accel-Redirect"] = current_app.config["X_ACCEL_PREFIX"].rstrip("/") + "/" + relative
+    if download_name:
+        disposition = "attachment" if as_attachment else "inline"
+        response.headers.set("Content-Disposition", disposition, filename=download_name)
+    response.set_etag(digest)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Answer revalidations here; nginx handles Range on the redirected body
+    return response.make_conditional(request, accept_ranges=False)
+
+
+def send_blob(digest, mimetype, as_attachment=False, download_name=None, last_modified=None, immutable=False, path=None):
+    """Serve a stored blob with conditional GET and Range support.
+
+    The SHA-256 digest is a strong ETag, so revalidation costs a 304 and
+    seeking in voice/video notes is answered with 206 partial content.
+    With SENDFILE_MODE = "x-accel" the byte transfer is offloaded to nginx;
+    with "x-sendfile" Flask's USE_X_SENDFILE does the same for Apache.
+    ``path`` serves a derived file (e.g. a preview) kept inside the store,
+    with ``digest`` as its ETag.
+    """
+    path = path or blob_path(digest)
+    if current_app.config.get("SENDFILE_MODE") == "x-accel":
+        response = _accel_response(path, digest, mimetype, as_attachment, download_name, last_modified)
+    else:
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            etag=digest,
+            last_modified=last_modified,
+            conditional=True
+        )
+
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Same URL may point at a newer version: always revalidate (cheap 304)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
@@ -1,18 +1,99 @@
-from app.models import FileRecord
 from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import FileRecord, Department, FileNumberCounter
+from app.utils.search import file_number_prefix
 
-DEPT_CODES = {
-    "Public Benefit Organisations Regulatory Authority": "PBORA",
-    "Ministry of Interior and National Planning": "MIN",
-    "PBO": "PBO",
-}
+UNKNOWN_DEPT_CODE = "XXX"
+SEQ_WIDTH = 5  # 5 digits
 
-def generate_file_number(department_name):
+
+def format_file_number(year, dept_code, seq):
+    return f"GOV-{year}-{dept_code}-{str(seq).zfill(SEQ_WIDTH)}"
+
+
+def seed_departments():
+    """Insert configured DEPARTMENT_CODES that are not in the registry yet."""
+    configured = current_app.config.get("DEPARTMENT_CODES", {})
+    if not configured:
+        return
+    known = {name for (name,) in db.session.query(Department.name).all()}
+    codes = {code for (code,) in db.session.query(Department.code).all()}
+    for name, code in configured.items():
+        if name not in known and code not in codes:
+            db.session.add(Department(name=name, code=code))
+            codes.add(code)
+    db.session.commit()
+
+
+def department_code(department_name):
+    if not department_name:
+        return UNKNOWN_DEPT_CODE
+    dept = Department.query.filter_by(name=department_name).first()
+    return dept.code if dept else UNKNOWN_DEPT_CODE
+
+
+def _highest_issued(year, dept_code):
+    # Numbers handed out before the counter table existed, from one index
+    # prefix scan (collation-safe on Postgres, see file_number_prefix).
+    # Suffixes are zero-padded only to SEQ_WIDTH, so past 99999 a string
+    # MAX is wrong; longer suffixes sort first instead, and any that are
+    # not numeric are skipped
+    prefix = f"GOV-{year}-{dept_code}-"
+    numbers = db.session.query(FileRecord.file_number).filter(
+        file_number_prefix(prefix)
+    ).order_by(db.func.length(FileRecord.file_number).desc(), FileRecord.file_number.desc())
+    for (number,) in numbers.yield_per(100):
+        suffix = number[len(prefix):]
+        if suffix.isdigit():
+            return int(suffix)
+    return 0
+
+
+def allocate_sequence(dept_code, year, count=1):
+    """Reserve ``count`` consecutive sequence numbers and return the first.
+
+    The counter row is bumped with a single conditional UPDATE, which takes
+    the row (Postgres) or database (SQLite) write lock until the caller's
+    transaction ends, so concurrent registrations serialise on that one
+    row instead of racing on a COUNT. The caller commits.
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+
+    counter = FileNumberCounter.__table__
+    where = (counter.c.dept_code == dept_code) & (counter.c.year == year)
+    for _ in range(2):
+        updated = db.session.execute(
+            counter.update().where(where).values(last_value=counter.c.last_value + count)
+        ).rowcount
+        if updated:
+            last = db.session.execute(db.select(counter.c.last_value).where(where)).scalar_one()
+            return last - count + 1
+
+        # First number for this department this year: create the counter,
+        # continuing after any numbers issued under the old COUNT scheme.
+        start = _highest_issued(year, dept_code)
+        try:
+            with db.session.begin_nested():
+                db.session.execute(counter.insert().values(
+                    dept_code=dept_code, year=year, last_value=start + count
+                ))
+            return start + 1
+        except IntegrityError:
+            # Another worker created it first; retry the UPDATE path
+            continue
+    raise RuntimeError(f"Could not allocate a file number for {dept_code}/{year}")
+
+
+def reserve_file_numbers(department_name, count):
+    """Pre-allocate a block of ``count`` file numbers for a department (bulk imports)."""
     year = datetime.utcnow().year
-    dept_code = DEPT_CODES.get(department_name, "XXX")
-    
-    # Count existing files for sequential ID
-    count = FileRecord.query.filter(FileRecord.department==department_name).count() + 1
-    seq_id = str(count).zfill(5)  # 5 digits
-    
-    return f"GOV-{year}-{dept_code}-{seq_id}"
+    code = department_code(department_name)
+    first = allocate_sequence(code, year, count)
+    return [format_file_number(year, code, seq) for seq in range(first, first + count)]
+
+
+def generate_file_number(department_name):
+    return reserve_file_numbers(department_name, 1)[0]
@@ -0,0 +1,84 @@
+from sqlalchemy import func
+from app.models import FileRecord
+from app.utils.pagination import keyset_paginate, page_size
+
+# Sortable registry columns: (SQL sort expression, value extractor for the cursor).
+# Nullable columns are coalesced so NULLs order the same on SQLite and Postgres.
+SORT_FIELDS = {
+    "id": (FileRecord.id, lambda f: f.id),
+    "file_number": (FileRecord.file_number, lambda f: f.file_number),
+    "name": (func.coalesce(FileRecord.name, ""), lambda f: f.name or ""),
+    "department": (func.coalesce(FileRecord.department, ""), lambda f: f.department or ""),
+}
+DEFAULT_SORT = "id"
+
+
+def _parse_bool(value):
+    if value is None or value == "":
+        return None
+    value = str(value).strip().lower()
+    if value in ("1", "true", "yes", "issued"):
+        return True
+    if value in ("0", "false", "no", "available"):
+        return False
+    return None
+
+
+def registry_params(args):
+    """Normalise registry query-string arguments into a filter/sort dict."""
+    sort = args.get("sort", DEFAULT_SORT)
+    return {
+        "department": (args.get("department") or "").strip() or None,
+        "is_issued": _parse_bool(args.get("is_issued")),
+        "name": (args.get("name") or "").strip() or None,
+        "sort": sort if sort in SORT_FIELDS else DEFAULT_SORT,
+        "order": "desc" if args.get("order") == "desc" else "asc",
+    }
+
+
+def filter_files(query, department=None, is_issued=None, name=None):
+    if department:
+        query = query.filter(FileRecord.department == department)
+    if is_issued is not None:
+        query = query.filter(FileRecord.is_issued == is_issued)
+    if name:
+        query = query.filter(FileRecord.name.startswith(name, autoescape=True))
+    return query
+
+
+def file_registry_page(params, cursor=None, limit=None):
+    """Return one keyset page of the file registry for ``params``."""
+    query = filter_files(
+        FileRecord.query,
+        department=params["department"],
+        is_issued=params["is_issued"],
+        name=params["name"],
+    )
+
+    sort_column, sort_value = SORT_FIELDS[params["sort"]]
+    if params["sort"] == "id":
+        columns = [FileRecord.id]
+        key = lambda f: [f.id]
+    else:
+        columns = [sort_column, FileRecord.id]
+        key = lambda f: [sort_value(f), f.id]
+
+    return keyset_paginate(
+        query,
+        columns,
+        cursor=cursor,
+        limit=page_size(limit),
+        descending=params["order"] == "desc",
+        key=key,
+    )
+
+
+def serialize_file(f):
+    return {
+        "id": f.id,
+        "file_number": f.file_number,
+        "name": f.name,
+        "department": f.department,
+        "filename": f.filename,
+        "is_issued": f.is_issued,
+    }
@@ -0,0 +1,196 @@
+import csv
+import io
+import os
+from collections import defaultdict
+from contextlib import ExitStack
+from sqlalchemy import insert
+from app import db
+from app.models import FileRecord
+from app.utils.search import deferred_search_index
+from app.utils.stats import deferred_department_stats
+from app.utils.file_numbering import reserve_file_numbers
+
+CHUNK_SIZE = 1000
+
+# Header spellings seen in departmental registers, mapped to FileRecord columns
+COLUMN_ALIASES = {
+    "file_number": "file_number",
+    "file_no": "file_number",
+    "file": "file_number",
+    "number": "file_number",
+    "name": "name",
+    "company": "name",
+    "company_name": "name",
+    "department": "department",
+    "dept": "department",
+}
+
+MAX_LENGTHS = {
+    "file_number": FileRecord.__table__.c.file_number.type.length,
+    "name": FileRecord.__table__.c.name.type.length,
+    "department": FileRecord.__table__.c.department.type.length,
+}
+
+ERROR_FIELDS = ["line", "file_number", "name", "department", "error"]
+
+
+class ImportResult:
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+        }
+
+
+def _header_key(value):
+    key = str(value or "").strip().lower().replace(" ", "_").replace(".", "")
+    return COLUMN_ALIASES.get(key)
+
+
+def _csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = [_header_key(h) for h in next(reader, [])]
+    for line, values in enumerate(reader, start=2):
+        yield line, {k: v for k, v in zip(header, values) if k}
+
+
+def _xlsx_rows(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX import requires the openpyxl package")
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_header_key(h) for h in next(rows, [])]
+        for line, values in enumerate(rows, start=2):
+            yield line, {k: v for k, v in zip(header, values) if k}
+    finally:
+        workbook.close()
+
+
+def iter_rows(stream, filename):
+    """Yield ``(line_number, row_dict)`` from a CSV or XLSX register without loading it whole."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        return _xlsx_rows(stream)
+    if ext in (".csv", ".txt", ""):
+        return _csv_rows(stream)
+    raise ValueError(f"Unsupported register format: {ext}")
+
+
+def _clean(row):
+    record = {}
+    for field in ("file_number", "name", "department"):
+        value = row.get(field)
+        value = "" if value is None else str(value).strip()
+        if len(value) > MAX_LENGTHS[field]:
+            return None, f"{field} longer than {MAX_LENGTHS[field]} characters"
+        record[field] = value or None
+    if not any(record.values()):
+        return None, "empty row"
+    return record, None
+
+
+def _existing_numbers(numbers):
+    return {n for (n,) in db.session.query(FileRecord.file_number)
+            .filter(FileRecord.file_number.in_(numbers)).all()}
+
+
+def import_file_records(rows, chunk_size=CHUNK_SIZE, error_writer=None, progress=None, defer_triggers=False):
+    """Insert validated register rows in batched ``executemany`` chunks.
+
+    ``rows`` is an iterable of ``(line, row_dict)``. Each chunk is checked
+    against existing file numbers with one ``IN`` query, rows without a
+    file number are numbered from one pre-allocated block per department,
+    and the chunk is committed on its own, so memory stays bounded and a failure late in a large
+    register keeps earlier chunks. Rejected rows go to ``error_writer``
+    (a ``csv.DictWriter`` over ERROR_FIELDS) and ``progress`` is called
+    with the running ImportResult after each chunk.
+
+    ``defer_triggers`` suspends the search index and department counter
+    triggers for the load and rebuilds them once at the end. The triggers
+    are global, so only set it when nothing else writes to ``files``
+    meanwhile (the CLI import); web imports keep per-row maintenance.
+    """
+    result = ImportResult()
+    seen = set()
+    table = FileRecord.__table__
+
+    def reject(line, row, message):
+        result.errors += 1
+        if error_writer is not None:
+            error_writer.writerow({
+                "line": line,
+                "file_number": row.get("file_number"),
+                "name": row.get("name"),
+                "department": row.get("department"),
+                "error": message,
+            })
+
+    def flush(chunk):
+        existing = _existing_numbers([r["file_number"] for _, r in chunk if r["file_number"]])
+        batch = []
+        unnumbered = defaultdict(list)
+        for line, record in chunk:
+            if not record["file_number"]:
+                unnumbered[record["department"]].append(record)
+            elif record["file_number"] in existing:
+                result.duplicates += 1
+                reject(line, record, "file_number already registered")
+            else:
+                batch.append(dict(record, is_issued=False))
+        # Rows without a number get one block of sequence numbers per department
+        for department, records in unnumbered.items():
+            for record, number in zip(records, reserve_file_numbers(department, len(records))):
+                batch.append(dict(record, file_number=number, is_issued=False))
+        if batch:
+            db.session.execute(insert(table), batch)
+            db.session.commit()
+            result.inserted += len(batch)
+        if progress is not None:
+            progress(result)
+
+    chunk = []
+    with ExitStack() as deferred:
+        if defer_triggers:
+            deferred.enter_context(deferred_search_index())
+            deferred.enter_context(deferred_department_stats())
+        for line, row in rows:
+            result.processed += 1
+            record, error = _clean(row)
+            if error:
+                reject(line, row, error)
+                continue
+            if record["file_number"] and record["file_number"] in seen:
+                result.duplicates += 1
+                reject(line, record, "file_number repeated in this register")
+                continue
+            if record["file_number"]:
+                seen.add(record["file_number"])
+            chunk.append((line, record))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+        elif progress is not None:
+            progress(result)
+
+    return result
+
+
+def open_error_writer(path):
+    handle = open(path, "w", newline="", encoding="utf-8")
+    writer = csv.DictWriter(handle, fieldnames=ERROR_FIELDS)
+    writer.writeheader()
+    return handle, writer
@@ -0,0 +1,118 @@
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from app.models import FileRecord, FileTransaction
+from app.utils.pagination import keyset_paginate, page_size
+from app.utils.signatures import attach_signature
+
+# All lookups filter on ``return_time IS NULL`` so they hit the partial
+# open-loan indexes declared on FileTransaction.
+
+
+def open_loans():
+    return FileTransaction.query.filter(FileTransaction.return_time.is_(None))
+
+
+def open_loan_for_file(file_id):
+    """Return the active transaction for a file, or None if it is on the shelf."""
+    return open_loans().filter(FileTransaction.file_id == file_id).first()
+
+
+def open_loans_for_user(user_id):
+    return open_loans().filter(FileTransaction.user_id == user_id) \
+        .options(joinedload(FileTransaction.file)) \
+        .order_by(FileTransaction.checkout_time.asc()).all()
+
+
+def holds_file(user_id, file_id):
+    return db.session.query(
+        open_loans().filter(
+            FileTransaction.file_id == file_id,
+            FileTransaction.user_id == user_id
+        ).exists()
+    ).scalar()
+
+
+def open_loans_by_age(limit=None):
+    """Open loans oldest first, with file and borrower loaded in the same query."""
+    query = open_loans().options(
+        joinedload(FileTransaction.file),
+        joinedload(FileTransaction.user)
+    ).order_by(FileTransaction.checkout_time.asc(), FileTransaction.id.asc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def issue_file(file, user_id, **fields):
+    """Open a loan on ``file`` for ``user_id`` in the current transaction.
+
+    ``is_issued`` is claimed with a conditional UPDATE, so when two clerks
+    check out the same file concurrently only one of them gets a row back.
+    Returns the new transaction, or None if the file was already issued.
+    The caller commits.
+    """
+    claimed = FileRecord.query.filter(
+        FileRecord.id == file.id,
+        db.or_(FileRecord.is_issued == False, FileRecord.is_issued.is_(None))
+    ).update({FileRecord.is_issued: True}, synchronize_session=False)
+    if not claimed:
+        return None
+    set_committed_value(file, "is_issued", True)
+
+    signature = fields.pop("checkout_signature", None)
+    tx = FileTransaction(file_id=file.id, user_id=user_id, **fields)
+    db.session.add(tx)
+    if signature:
+        attach_signature(tx, "checkout", signature)
+    return tx
+
+
+def close_loan(tx, **fields):
+    """Close an open loan and put its file back on the shelf. The caller commits."""
+    tx.return_time = fields.pop("return_time", None) or datetime.utcnow()
+    signature = fields.pop("return_signature", None)
+    if signature:
+        attach_signature(tx, "return", signature)
+    for name, value in fields.items():
+        setattr(tx, name, value)
+    FileRecord.query.filter(FileRecord.id == tx.file_id) \
+        .update({FileRecord.is_issued: False}, synchronize_session=False)
+    if tx.file is not None:
+        set_committed_value(tx.file, "is_issued", False)
+    return tx
+
+
+def file_history_page(file_id, cursor=None, limit=None):
+    """Newest-first keyset page of a file's transactions, users joined in.
+
+    Served by ix_file_transactions_file_checkout; the id breaks ties between
+    movements recorded in the same instant.
+    """
+    query = FileTransaction.query.filter(FileTransaction.file_id == file_id).options(
+        joinedload(FileTransaction.user),
+        joinedload(FileTransaction.issued_by),
+        joinedload(FileTransaction.returned_to),
+    )
+    return keyset_paginate(
+        query,
+        [FileTransaction.checkout_time, FileTransaction.id],
+        cursor=cursor,
+        limit=page_size(limit, default=25),
+        descending=True,
+    )
+
+
+def serialize_transaction(tx):
+    return {
+        "id": tx.id,
+        "user": tx.user.name if tx.user else None,
+        "checkout_time": tx.checkout_time.isoformat(),
+        "return_time": tx.return_time.isoformat() if tx.return_time else None,
+        "issued_by": tx.issued_by.name if tx.issued_by else None,
+        "returned_to": tx.returned_to.name if tx.returned_to else None,
+        "purpose": tx.purpose,
+        "comments": tx.comments,
+        "condition": tx.condition,
+    }
@@ -0,0 +1,190 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import FileTransaction, Notification
+from app.utils.loans import open_loans
+from app.utils.pagination import keyset_paginate
+
+SCAN_BATCH_SIZE = 500
+
+
+def enqueue(recipient, message, dedupe_key=None, channel="sms", commit=True):
+    """Add a message to the outbound queue. Returns False if ``dedupe_key`` was already queued."""
+    if dedupe_key and Notification.query.filter_by(dedupe_key=dedupe_key).first():
+        return False
+    db.session.add(Notification(channel=channel, recipient=recipient, message=message, dedupe_key=dedupe_key))
+    if commit:
+        db.session.commit()
+    return True
+
+
+def _insert_new(rows):
+    """Insert notification rows, skipping any whose dedupe_key already exists.
+
+    One INSERT ... ON CONFLICT DO NOTHING on SQLite and Postgres; a savepoint
+    per row elsewhere. Returns the number of rows inserted.
+    """
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(Notification) \
+            .on_conflict_do_nothing(index_elements=["dedupe_key"]) \
+            .returning(Notification.id)
+        return len(db.session.execute(stmt, rows).all())
+    inserted = 0
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Notification), [row])
+            inserted += 1
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def overdue_message(tx):
+    return (
+        f"Reminder: file {tx.file.file_number} taken on {tx.checkout_time:%d %b %Y} "
+        f"is overdue. Please return it to the registry."
+    )
+
+
+def scan_overdue_loans(now=None):
+    """Queue SMS reminders for open loans past the due period.
+
+    Walks only the overdue part of the open-loan age index
+    (ix_open_loans_age) in keyset batches, so the cost follows the number of
+    overdue loans rather than the size of the history. Each loan gets at most
+    one reminder per OVERDUE_REMINDER_HOURS period: a rerun skips keys it
+    can see are queued, and rows a concurrent scheduler inserted in the
+    meantime are dropped by the unique dedupe_key rather than failing the
+    batch. Returns the number queued.
+    """
+    config = current_app.config
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=config["LOAN_DUE_DAYS"])
+    period = timedelta(hours=config["OVERDUE_REMINDER_HOURS"])
+
+    queued = 0
+    cursor = None
+    while True:
+        page = keyset_paginate(
+            open_loans().filter(FileTransaction.checkout_time < cutoff).options(
+                joinedload(FileTransaction.file), joinedload(FileTransaction.user)
+            ),
+            [FileTransaction.checkout_time, FileTransaction.id],
+            cursor=cursor,
+            limit=SCAN_BATCH_SIZE,
+        )
+        batch = page.items
+        if not batch:
+            break
+
+        candidates = {}
+        for tx in batch:
+            if not tx.user or not tx.user.phone:
+                continue
+            overdue_for = now - (tx.checkout_time + timedelta(days=config["LOAN_DUE_DAYS"]))
+            key = f"overdue:{tx.id}:{int(overdue_for / period)}"
+            candidates[key] = {"recipient": tx.user.phone, "message": overdue_message(tx), "dedupe_key": key}
+
+        if candidates:
+            existing = {k for (k,) in db.session.query(Notification.dedupe_key).filter(
+                Notification.dedupe_key.in_(list(candidates))
+            )}
+            rows = [row for key, row in candidates.items() if key not in existing]
+            if rows:
+                queued += _insert_new([
+                    dict(row, channel="sms", status="pending", attempts=0, next_attempt_at=now, created_at=now)
+                    for row in rows
+                ])
+        db.session.commit()
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    return queued
+
+
+def _claim(batch_size, now):
+    due = db.session.query(Notification.id).filter(
+        Notification.status == "pending", Notification.next_attempt_at <= now
+    ).order_by(Notification.next_attempt_at, Notification.id).limit(batch_size).all()
+    ids = [i for (i,) in due]
+    if not ids:
+        return []
+    # Conditional claim stamped with this run's timestamp: rows another
+    # dispatcher took in the meantime carry its stamp and are skipped
+    Notification.query.filter(
+        Notification.id.in_(ids), Notification.status == "pending"
+    ).update({Notification.status: "sending", Notification.next_attempt_at: now}, synchronize_session=False)
+    db.session.commit()
+    return Notification.query.filter(
+        Notification.id.in_(ids), Notification.status == "sending", Notification.next_attempt_at == now
+    ).all()
+
+
+def dispatch_notifications(transport=None, max_batches=None):
+    """Drain due messages from the queue in batches, rate limited.
+
+    Failed sends are retried with exponential backoff until
+    NOTIFICATION_MAX_ATTEMPTS, then marked failed. Raises RuntimeError before
+    claiming anything if no SMS transport is configured. Returns ``(sent, failed)``.
+    """
+    from app.utils.sms import get_transport
+
+    config = current_app.config
+    transport = transport or get_transport()
+    batch_size = config["SMS_BATCH_SIZE"]
+    min_interval = batch_size / config["SMS_RATE_PER_SECOND"] if config["SMS_RATE_PER_SECOND"] else 0
+
+    sent = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        started = time.monotonic()
+        now = datetime.utcnow()
+        batch = _claim(batch_size, now)
+        if not batch:
+            break
+        batches += 1
+
+        try:
+            errors = transport.send([(n.recipient, n.message) for n in batch])
+        except Exception as e:
+            errors = [str(e)] * len(batch)
+
+        for notification, error in zip(batch, errors):
+            notification.attempts += 1
+            if error is None:
+                notification.status = "sent"
+                notification.sent_at = now
+                notification.last_error = None
+                sent += 1
+            elif notification.attempts >= config["NOTIFICATION_MAX_ATTEMPTS"]:
+                notification.status = "failed"
+                notification.last_error = str(error)[:250]
+                failed += 1
+            else:
+                notification.status = "pending"
+                notification.last_error = str(error)[:250]
+                notification.next_attempt_at = now + timedelta(minutes=2 ** notification.attempts)
+        db.session.commit()
+
+        # Keep under the provider's rate limit across consecutive batches
+        elapsed = time.monotonic() - started
+        if len(batch) == batch_size and elapsed < min_interval:
+            time.sleep(min_interval - elapsed)
+    return sent, failed
+
+
+def release_stuck_notifications(older_than_minutes=15):
+    """Return messages left in "sending" by a crashed dispatcher to the queue."""
+    cutoff = datetime.utcnow() - timedelta(minutes=older_than_minutes)
+    released = Notification.query.filter(
+        Notification.status == "sending", Notification.next_attempt_at < cutoff
+    ).update({Notification.status: "pending"}, synchronize_session=False)
+    db.session.commit()
+    return released
+
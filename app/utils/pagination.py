@@ -0,0 +1,100 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    # Datetimes are tagged so they round-trip back into comparable values
+    payload = [{"dt": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_value(value):
+    # Cursors come from clients, so anything encode_cursor() would not
+    # produce is rejected rather than passed on to the query
+    if isinstance(value, dict):
+        if set(value) != {"dt"}:
+            raise ValueError("Invalid cursor")
+        try:
+            return datetime.fromisoformat(value["dt"])
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def decode_cursor(token):
+    """Values from an encode_cursor() token; raises ValueError for a malformed one."""
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, list):
+        raise ValueError("Invalid cursor")
+    return [_decode_value(v) for v in payload]
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class Page:
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _after(columns, values, descending):
+    # Expanded row-value comparison: (a, b) > (x, y)  ->  a > x OR (a = x AND b > y)
+    clauses = []
+    for i, column in enumerate(columns):
+        cmp = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], cmp))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False, key=None):
+    """Seek-paginate ``query`` ordered by ``columns``.
+
+    The last column must be unique (normally the primary key) so the ordering
+    is total. ``key`` extracts the cursor values from a result item and
+    defaults to reading each column's attribute name.
+    """
+    if key is None:
+        key = lambda item: [getattr(item, c.key) for c in columns]
+
+    values = decode_cursor(cursor)
+    if values is not None:
+        if len(values) != len(columns):
+            raise ValueError("Invalid cursor")
+        query = query.filter(_after(columns, values, descending))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    items = rows[:limit]
+    next_cursor = encode_cursor(key(items[-1])) if len(rows) > limit else None
+    return Page(items, next_cursor)
@@ -1,17 +1,140 @@
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+import glob
+import hashlib
+import os
+import tempfile
+from xml.sax.saxutils import escape
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import FileRecord, FileTransaction
+from app.utils.background import offload, submit
 
-def generate_file_report(file):
-    filename = f"app/static/reports/file_{file.file_number}.pdf"
-    c = canvas.Canvas(filename, pagesize=A4)
+# Bump when the layout changes so cached reports are regenerated
+REPORT_VERSION = 1
 
-    c.drawString(40, 800, f"FILE REPORT: {file.file_number}")
-    c.drawString(40, 780, f"Department: {file.department}")
 
-    y = 740
-    for tx in file.transactions:
-        c.drawString(40, y, f"{tx.user.name} | {tx.checkout_time}")
-        y -= 15
+def reports_dir():
+    return os.path.join(current_app.instance_path, "reports")
 
-    c.save()
-    return filename
+
+def report_key(file):
+    """Cache key for a file's movement report.
+
+    Derived from the newest transaction (a return updates the row in place,
+    so the latest return time counts too) and the file's own details; any
+    movement produces a new key and unchanged files keep theirs.
+    """
+    count, last_id, last_return = db.session.query(
+        func.count(FileTransaction.id), func.max(FileTransaction.id), func.max(FileTransaction.return_time)
+    ).filter(FileTransaction.file_id == file.id).one()
+    raw = f"{REPORT_VERSION}|{file.file_number}|{file.name}|{file.department}|{count}|{last_id}|{last_return}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def report_path(file, key):
+    return os.path.join(reports_dir(), f"file_{file.id}-{key}.pdf")
+
+
+def _rows(file_id):
+    # One query for the whole history, users included
+    transactions = FileTransaction.query.filter_by(file_id=file_id).options(
+        joinedload(FileTransaction.user),
+        joinedload(FileTransaction.issued_by),
+        joinedload(FileTransaction.returned_to),
+    ).order_by(FileTransaction.checkout_time, FileTransaction.id).all()
+
+    fmt = "%Y-%m-%d %H:%M"
+    return [[
+        tx.user.name if tx.user else "-",
+        tx.checkout_time.strftime(fmt),
+        tx.issued_by.name if tx.issued_by else "-",
+        tx.return_time.strftime(fmt) if tx.return_time else "Still out",
+        tx.returned_to.name if tx.returned_to else "-",
+        tx.condition or "-",
+        tx.purpose or tx.comments or "",
+    ] for tx in transactions]
+
+
+def render_report(out, title_lines, rows):
+    """Lay out a movement history as a paginated A4 table into ``out``."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, Spacer, TableStyle
+
+    styles = getSampleStyleSheet()
+    cell = styles["BodyText"].clone("cell", fontSize=8, leading=10)
+
+    def footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.drawRightString(doc.pagesize[0] - 15 * mm, 10 * mm, f"{title_lines[0]} - page {doc.page}")
+        canvas.restoreState()
+
+    header = ["Taken by", "Checked out", "Issued by", "Returned", "Received by", "Condition", "Purpose / comments"]
+    data = [header] + [row[:-1] + [Paragraph(escape(row[-1]), cell)] for row in rows]
+    table = LongTable(data, repeatRows=1, colWidths=[38 * mm, 30 * mm, 32 * mm, 30 * mm, 32 * mm, 22 * mm, None])
+    table.setStyle(TableStyle([
+        ("FONT", (0, 0), (-1, 0), "Helvetica-Bold", 8),
+        ("FONT", (0, 1), (-2, -1), "Helvetica", 8),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#006D77")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#F1F5F9")]),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#CBD5E1")),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ]))
+
+    doc = SimpleDocTemplate(
+        out, pagesize=landscape(A4), title=title_lines[0],
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=18 * mm
+    )
+    story = [Paragraph(escape(title_lines[0]), styles["Title"])]
+    story += [Paragraph(escape(line), styles["Normal"]) for line in title_lines[1:]]
+    story.append(Spacer(1, 6 * mm))
+    story.append(table if rows else Paragraph("No movements recorded.", styles["Normal"]))
+    doc.build(story, onFirstPage=footer, onLaterPages=footer)
+
+
+def generate_file_report(file_id, key):
+    """Build the movement report for ``file_id`` and store it under ``key``."""
+    file = db.session.get(FileRecord, file_id)
+    if file is None:
+        return None
+    path = report_path(file, key)
+    if os.path.exists(path):
+        return path
+
+    title = [
+        f"File movement report: {file.file_number}",
+        f"Company: {file.name or '-'}",
+        f"Department: {file.department or '-'}",
+    ]
+    rows = _rows(file.id)
+
+    os.makedirs(reports_dir(), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=reports_dir(), suffix=".tmp")
+    os.close(fd)
+    try:
+        offload(render_report, tmp, title, rows)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    # Older reports for this file can never be served again
+    for stale in glob.glob(os.path.join(reports_dir(), f"file_{file.id}-*.pdf")):
+        if stale != path:
+            os.remove(stale)
+    return path
+
+
+def request_file_report(file):
+    """Return ``(path, key)`` of a ready report, or ``(None, key)`` after queueing it."""
+    key = report_key(file)
+    path = report_path(file, key)
+    if os.path.exists(path):
+        return path, key
+    submit(f"report:{file.id}:{key}", generate_file_report, file.id, key)
+    return None, key
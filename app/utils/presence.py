@@ -0,0 +1,83 @@
+import threading
+import time
+from flask import current_app
+from app import cache
+from app.models import User
+
+# Socket.IO connections to this worker, {user_id: {sid, ...}}
+_sids = {}
+_lock = threading.Lock()
+
+
+# One cache entry, {user_id: last_seen}, shared by every worker. Entries
+# expire individually: readers skip, and writers prune, any older than
+# PRESENCE_TTL. Writes are read-modify-write, so two workers updating at
+# once can lose one change; a lost touch comes back with the next
+# heartbeat, well inside PRESENCE_TTL
+_PRESENCE_KEY = "presence"
+
+
+def _ttl():
+    return current_app.config["PRESENCE_TTL"]
+
+
+def _live(entries, now):
+    return {user_id: seen for user_id, seen in (entries or {}).items() if now - seen < _ttl()}
+
+
+def _update(user_id, last_seen):
+    """Set or (with None) remove one entry; returns whether it was live before."""
+    now = time.time()
+    with _lock:
+        entries = _live(cache.get(_PRESENCE_KEY), now)
+        was_live = user_id in entries
+        if last_seen is None:
+            entries.pop(user_id, None)
+        else:
+            entries[user_id] = last_seen
+        cache.set(_PRESENCE_KEY, entries, timeout=_ttl())
+    return was_live
+
+
+def touch(user_id):
+    """Record that ``user_id`` is online for another PRESENCE_TTL seconds.
+
+    Presence lives in the shared cache, so every worker sees the same users
+    and a client that vanishes without disconnecting ages out on its own.
+    Returns True if the user was offline until now.
+    """
+    return not _update(user_id, time.time())
+
+
+def connect(user_id, sid):
+    """Register a socket; returns True if the user just came online."""
+    with _lock:
+        _sids.setdefault(user_id, set()).add(sid)
+    return touch(user_id)
+
+
+def disconnect(user_id, sid):
+    """Drop a socket; returns True if the user went offline.
+
+    A user stays online while any of their tabs on this worker is connected.
+    Tabs held by another worker put them back on that tab's next heartbeat.
+    """
+    with _lock:
+        sids = _sids.get(user_id, set())
+        sids.discard(sid)
+        if sids:
+            return False
+        _sids.pop(user_id, None)
+    _update(user_id, None)
+    return True
+
+
+def online_user_ids():
+    return list(_live(cache.get(_PRESENCE_KEY), time.time()))
+
+
+def online_users():
+    ids = online_user_ids()
+    if not ids:
+        return []
+    return User.query.filter(User.id.in_(ids)).order_by(User.name).all()
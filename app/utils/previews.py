@@ -0,0 +1,102 @@
+import os
+import tempfile
+from app.utils.background import offload, submit
+from app.utils.blob_store import blob_path, store_root
+
+# Bounding boxes for generated images; bump RENDER_VERSION when output changes
+PREVIEW_SIZES = {"thumb": (160, 160), "page": (800, 1100)}
+RENDER_VERSION = 1
+PREVIEW_MIMETYPE = "image/webp"
+
+
+def preview_key(digest, size):
+    # Derived from the content hash, so a preview never needs invalidating
+    return f"{digest}-{size}-v{RENDER_VERSION}"
+
+
+def preview_path(digest, size):
+    key = preview_key(digest, size)
+    return os.path.join(store_root(), "previews", digest[:2], digest[2:4], key + ".webp")
+
+
+def can_preview(content_type):
+    content_type = content_type or ""
+    return content_type.startswith("image/") or content_type == "application/pdf"
+
+
+def _open_image(path, content_type, box):
+    from PIL import Image, ImageOps
+
+    if content_type == "application/pdf":
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            return None
+        pdf = pdfium.PdfDocument(path)
+        try:
+            page = pdf[0]
+            # Render at just enough resolution for the largest box
+            scale = min(box[0] / page.get_width(), box[1] / page.get_height()) * 2
+            return page.render(scale=max(scale, 0.1)).to_pil()
+        finally:
+            pdf.close()
+
+    image = Image.open(path)
+    # JPEG can decode straight at a reduced scale instead of full size
+    image.draft("RGB", box)
+    return ImageOps.exif_transpose(image)
+
+
+def render_previews(source, content_type, targets):
+    """Render ``source`` into each ``(box, destination)`` in ``targets``.
+
+    The source is decoded once for all sizes. Files are written to a temp
+    name and moved into place, so a half-written preview is never served.
+    """
+    image = _open_image(source, content_type, max(box for box, _ in targets))
+    if image is None:
+        return False
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    for box, destination in sorted(targets, reverse=True):
+        image.thumbnail(box)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destination))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, "WEBP", quality=80, method=4)
+            os.replace(tmp, destination)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return True
+
+
+def missing_previews(digest):
+    """Return the ``(box, destination)`` pairs not yet rendered for a blob."""
+    return [
+        (box, preview_path(digest, size))
+        for size, box in PREVIEW_SIZES.items()
+        if not os.path.exists(preview_path(digest, size))
+    ]
+
+
+def _render(digest, content_type):
+    targets = missing_previews(digest)
+    if targets:
+        offload(render_previews, blob_path(digest), content_type, targets)
+
+
+def schedule_previews(versions):
+    """Queue preview generation for newly committed file versions.
+
+    Call after the commit so workers only ever see stored blobs. Blobs that
+    already have previews, or are already queued, are skipped.
+    """
+    for version in versions:
+        if version is None or not can_preview(version.content_type):
+            continue
+        digest = version.blob_sha256
+        if missing_previews(digest):
+            submit(f"preview:{digest}", _render, digest, version.content_type)
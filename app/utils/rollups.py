@@ -0,0 +1,192 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import ChatMessage, DailyActivity, FileRecord, FileTransaction, RollupWatermark
+from app.utils.background import submit
+from app.utils.caching import cached
+
+# Days aggregated per INSERT while catching up, bounding memory on a backfill
+CHUNK_DAYS = 31
+METRICS = ("checkouts", "returns", "messages")
+# daily_activity.user_id for events without a user; part of the primary key
+NO_USER = 0
+# rollup_watermarks row tracking daily_activity
+WATERMARK = "daily_activity"
+
+
+def _day(value):
+    # func.date() gives a string on SQLite and a date on Postgres
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def _bounds(start, end):
+    return datetime.combine(start, time.min), datetime.combine(end, time.min)
+
+
+def _aggregate(start, end):
+    """``{(day, department, user_id): [checkouts, returns, messages]}`` for days in [start, end).
+
+    Three GROUP BYs, each over an indexed timestamp range.
+    """
+    lo, hi = _bounds(start, end)
+    totals = defaultdict(lambda: [0, 0, 0])
+    department = func.coalesce(FileRecord.department, "")
+
+    for i, column in enumerate((FileTransaction.checkout_time, FileTransaction.return_time)):
+        day = func.date(column)
+        user_id = func.coalesce(FileTransaction.user_id, NO_USER)
+        rows = db.session.query(day, department, user_id, func.count()) \
+            .join(FileRecord, FileRecord.id == FileTransaction.file_id) \
+            .filter(column >= lo, column < hi) \
+            .group_by(day, department, user_id)
+        for d, dept, user_id, n in rows:
+            totals[(_day(d), dept, user_id)][i] += n
+
+    day = func.date(ChatMessage.timestamp)
+    user_id = func.coalesce(ChatMessage.sender_id, NO_USER)
+    rows = db.session.query(day, user_id, func.count()) \
+        .filter(ChatMessage.timestamp >= lo, ChatMessage.timestamp < hi) \
+        .group_by(day, user_id)
+    for d, user_id, n in rows:
+        totals[(_day(d), "", user_id)][2] += n
+    return totals
+
+
+def _first_event_day():
+    firsts = [
+        db.session.query(func.min(FileTransaction.checkout_time)).scalar(),
+        db.session.query(func.min(ChatMessage.timestamp)).scalar(),
+    ]
+    firsts = [f for f in firsts if f is not None]
+    return min(firsts).date() if firsts else None
+
+
+def _start_watermark():
+    """Create the watermark at the first recorded event; returns it, or None.
+
+    Rows left from before the watermark existed cannot be trusted to cover
+    every day, so they are dropped and rolled up again.
+    """
+    first = _first_event_day()
+    if first is None:
+        return None
+    DailyActivity.query.delete(synchronize_session=False)
+    db.session.add(RollupWatermark(name=WATERMARK, until=first))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker started it first
+        db.session.rollback()
+        return None
+    return first
+
+
+def roll_up_activity(today=None):
+    """Roll up every closed day (before today) not yet in daily_activity.
+
+    Picks up at the watermark, or from the first recorded event when there
+    is none, so the same call both backfills history and keeps the table
+    current; when nothing is pending it costs one primary-key read. The
+    watermark advances in the same transaction as each chunk's rows, idle
+    days included, and only from where this call found it, so racing workers
+    never write a day twice. Closed days are written once and never
+    revisited, which is safe because checkouts, returns and messages are
+    stamped with the time they happen. Use rebuild_activity() after editing
+    history. Returns the rows written.
+    """
+    today = today or datetime.utcnow().date()
+    start = _rolled_up_until() or _start_watermark()
+    if start is None:
+        return 0
+
+    written = 0
+    while start < today:
+        end = min(start + timedelta(days=CHUNK_DAYS), today)
+        rows = [
+            {"day": d, "department": dept, "user_id": user_id,
+             "checkouts": c, "returns": r, "messages": m}
+            for (d, dept, user_id), (c, r, m) in _aggregate(start, end).items()
+        ]
+        advanced = db.session.execute(
+            update(RollupWatermark)
+            .where(RollupWatermark.name == WATERMARK, RollupWatermark.until == start)
+            .values(until=end)
+        ).rowcount
+        if not advanced:
+            # Another worker rolled up the same days first
+            db.session.rollback()
+            return written
+        if rows:
+            db.session.execute(insert(DailyActivity), rows)
+        db.session.commit()
+        written += len(rows)
+        start = end
+    return written
+
+
+def rebuild_activity(since=None):
+    """Drop rollups from ``since`` (default: all) and roll them up again from history."""
+    query = DailyActivity.query
+    watermark = RollupWatermark.query.filter_by(name=WATERMARK)
+    if since is not None:
+        query = query.filter(DailyActivity.day >= since)
+        watermark.filter(RollupWatermark.until > since) \
+            .update({"until": since}, synchronize_session=False)
+    else:
+        watermark.delete(synchronize_session=False)
+    query.delete(synchronize_session=False)
+    db.session.commit()
+    return roll_up_activity()
+
+
+def _rolled_up_until():
+    """First day not yet in daily_activity, or None before the first rollup."""
+    return db.session.query(RollupWatermark.until).filter_by(name=WATERMARK).scalar()
+
+
+def activity_summary(days, by, today=None):
+    """Totals ``{key: [checkouts, returns, messages]}`` over the last ``days`` days.
+
+    ``by`` is "day", "department" or "user_id". Rolled-up days come from one
+    GROUP BY over a daily_activity range; days the rollup has not reached
+    yet (always today, more if the job is behind) are aggregated live from
+    their own indexed ranges. Views never roll up themselves: when closed
+    days are missing, as on a deploy without the scheduler,
+    roll_up_activity() is queued in the background so later requests stop
+    paying for them. Results are cached until any of those tables change.
+    """
+    today = today or datetime.utcnow().date()
+    until = _rolled_up_until()
+    if until is None or until < today:
+        submit("rollup-activity", roll_up_activity)
+    return _summary(days, by, today)
+
+
+# ``today`` is an argument so cached summaries roll over at midnight
+@cached("files", "transactions", "chat", "rollups")
+def _summary(days, by, today):
+    start = today - timedelta(days=days - 1)
+    live_from = max(start, min(_rolled_up_until() or start, today))
+    key = getattr(DailyActivity, by)
+    rows = db.session.query(key, *[func.sum(getattr(DailyActivity, m)) for m in METRICS]) \
+        .filter(DailyActivity.day >= start, DailyActivity.day < live_from) \
+        .group_by(key)
+    totals = {k: [int(v or 0) for v in values] for k, *values in rows}
+
+    position = {"day": 0, "department": 1, "user_id": 2}[by]
+    for group, counts in _aggregate(live_from, today + timedelta(days=1)).items():
+        total = totals.setdefault(group[position], [0, 0, 0])
+        for i, n in enumerate(counts):
+            total[i] += n
+    return totals
+
+
+def activity_series(days, today=None):
+    """``(dates, checkouts, returns, messages)`` per day, oldest first, gaps zero-filled."""
+    today = today or datetime.utcnow().date()
+    totals = activity_summary(days, "day", today=today)
+    dates = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    series = [[totals.get(d, (0, 0, 0))[i] for d in dates] for i in range(len(METRICS))]
+    return [str(d) for d in dates], *series
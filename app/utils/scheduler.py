@@ -0,0 +1,34 @@
+from datetime import datetime
+from app import db
+
+
+def start_scheduler(app):
+    """Run periodic jobs in-process (see SCHEDULER_ENABLED).
+
+    Each job is also a CLI command, for deployments that prefer cron.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from app.utils.notifications import dispatch_notifications, release_stuck_notifications, scan_overdue_loans
+    from app.utils.rollups import roll_up_activity
+
+    scheduler = BackgroundScheduler(daemon=True)
+
+    def run(job):
+        with app.app_context():
+            try:
+                job()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Scheduled %s failed", job.__name__)
+
+    scheduler.add_job(run, "interval", minutes=30, args=[scan_overdue_loans], max_instances=1, coalesce=True)
+    if app.config["SMS_TRANSPORT"]:
+        scheduler.add_job(run, "interval", minutes=1, args=[dispatch_notifications], max_instances=1, coalesce=True)
+        scheduler.add_job(run, "interval", minutes=15, args=[release_stuck_notifications], max_instances=1, coalesce=True)
+    else:
+        app.logger.warning("SMS_TRANSPORT is not set; queued SMS reminders will not be sent")
+    # Also right away, so a fresh deploy backfills history off the request path
+    scheduler.add_job(run, "interval", hours=1, args=[roll_up_activity], max_instances=1, coalesce=True,
+                      next_run_time=datetime.now())
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,369 @@
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from markupsafe import Markup, escape
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import ChatMessage, FileRecord
+
+# Highest code point, used as an exclusive upper bound for prefix range scans.
+# Only safe under SQLite's default BINARY collation; Postgres sorts with the
+# database locale, so it gets a LIKE prefix match instead.
+_PREFIX_END = "\U0010ffff"
+
+_SQLITE_FILES_FTS = [
+    """CREATE VIRTUAL TABLE files_fts USING fts5(
+        file_number, name, department,
+        content='files', content_rowid='id', prefix='2 3 4'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, file_number, name, department)
+        VALUES (new.id, new.file_number, new.name, new.department);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, file_number, name, department)
+        VALUES ('delete', old.id, old.file_number, old.name, old.department);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF file_number, name, department ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, file_number, name, department)
+        VALUES ('delete', old.id, old.file_number, old.name, old.department);
+        INSERT INTO files_fts(rowid, file_number, name, department)
+        VALUES (new.id, new.file_number, new.name, new.department);
+    END""",
+]
+
+# File numbers are split on punctuation so "OP/218/051" indexes as three words
+# instead of one path-like token from the default parser
+_POSTGRES_FILES_DOCUMENT = (
+    "to_tsvector('simple', regexp_replace(coalesce(file_number, ''), '[^[:alnum:]]+', ' ', 'g') || ' ' || "
+    "coalesce(name, '') || ' ' || coalesce(department, ''))"
+)
+
+# text_pattern_ops lets a b-tree serve "file_number LIKE 'OP/2%'" whatever
+# the database collation is; the default operator class only can under "C"
+_POSTGRES_FILES_FTS = [
+    f"CREATE INDEX IF NOT EXISTS ix_files_search ON files USING gin ({_POSTGRES_FILES_DOCUMENT})",
+    "CREATE INDEX IF NOT EXISTS ix_files_file_number_pattern ON files (file_number text_pattern_ops)",
+]
+
+# Superseded by ix_files_file_number_pattern; no query ever used it
+_POSTGRES_OBSOLETE = [
+    "DROP INDEX IF EXISTS ix_files_file_number_trgm",
+]
+
+_SQLITE_CHAT_FTS = [
+    """CREATE VIRTUAL TABLE chat_messages_fts USING fts5(
+        message, content='chat_messages', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+    # Also fires per row when a room's messages are deleted with it
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF message ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+]
+
+_POSTGRES_CHAT_DOCUMENT = "to_tsvector('simple', coalesce(message, ''))"
+
+_POSTGRES_CHAT_FTS = [
+    f"CREATE INDEX IF NOT EXISTS ix_chat_messages_search ON chat_messages USING gin ({_POSTGRES_CHAT_DOCUMENT})",
+]
+
+# Set by ensure_search_index(); None means no full-text backend, fall back to LIKE
+_backend = None
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _ensure_sqlite_fts(conn, name, ddls):
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"
+    ), {"name": name}).first()
+    if not exists:
+        conn.execute(text(ddls[0]))
+    for ddl in ddls[1:]:
+        conn.execute(text(ddl))
+    if not exists:
+        conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+
+
+def ensure_search_index():
+    """Create the full-text indexes for the file registry and chat messages if missing.
+
+    SQLite uses an external-content FTS5 table kept in sync by triggers, so
+    uploads, edits and bulk inserts are all indexed without application code.
+    Postgres uses a GIN expression index, which the planner maintains itself.
+    """
+    global _backend
+    dialect = _dialect()
+    try:
+        if dialect == "sqlite":
+            with db.engine.begin() as conn:
+                _ensure_sqlite_fts(conn, "files_fts", _SQLITE_FILES_FTS)
+                _ensure_sqlite_fts(conn, "chat_messages_fts", _SQLITE_CHAT_FTS)
+            _backend = "fts5"
+        elif dialect == "postgresql":
+            with db.engine.begin() as conn:
+                for ddl in _POSTGRES_FILES_FTS + _POSTGRES_CHAT_FTS:
+                    conn.execute(text(ddl))
+            _backend = "tsvector"
+            try:
+                with db.engine.begin() as conn:
+                    for ddl in _POSTGRES_OBSOLETE:
+                        conn.execute(text(ddl))
+            except DBAPIError:
+                # Dropping needs ownership of the index; leaving it is harmless
+                pass
+    except DBAPIError:
+        _backend = None
+
+
+def rebuild_search_index():
+    if _backend == "fts5":
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO files_fts(files_fts) VALUES ('rebuild')"))
+
+
+def rebuild_message_index():
+    if _backend == "fts5":
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"))
+
+
+@contextmanager
+def deferred_search_index():
+    """Suspend per-row FTS maintenance for a bulk load and rebuild once afterwards.
+
+    FTS5 trigger maintenance dominates the cost of large inserts, while a
+    single 'rebuild' over the content table is an order of magnitude
+    cheaper. The trigger is dropped for every connection, and an update or
+    delete of a row inserted meanwhile corrupts the index, so use this only
+    while nothing else writes to ``files`` (the CLI import). If the process
+    dies mid-load, ensure_search_index() restores the trigger on the next
+    start and rebuild_search_index() repairs it.
+    """
+    if _backend != "fts5":
+        yield
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TRIGGER IF EXISTS files_fts_ai"))
+    try:
+        yield
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(text(_SQLITE_FILES_FTS[1]))
+            conn.execute(text("INSERT INTO files_fts(files_fts) VALUES ('rebuild')"))
+
+
+def _tokens(query):
+    return re.findall(r"\w+", query or "")
+
+
+def _fts5_match(tokens):
+    # Every token must match as a prefix; quoting keeps FTS5 operators inert
+    return " ".join('"%s"*' % t.replace('"', '""') for t in tokens)
+
+
+def _tsquery(tokens):
+    return " & ".join("%s:*" % t for t in tokens)
+
+
+def search_files(query, limit=20):
+    """Rank registry entries matching every word prefix in ``query``."""
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+
+    if _backend == "fts5":
+        rows = db.session.execute(text(
+            "SELECT rowid FROM files_fts WHERE files_fts MATCH :match "
+            "ORDER BY bm25(files_fts, 10.0, 2.0, 1.0) LIMIT :limit"
+        ), {"match": _fts5_match(tokens), "limit": limit}).all()
+        ids = [r[0] for r in rows]
+    elif _backend == "tsvector":
+        rows = db.session.execute(text(
+            f"SELECT id FROM files WHERE {_POSTGRES_FILES_DOCUMENT} @@ to_tsquery('simple', :q) "
+            f"ORDER BY ts_rank({_POSTGRES_FILES_DOCUMENT}, to_tsquery('simple', :q)) DESC LIMIT :limit"
+        ), {"q": _tsquery(tokens), "limit": limit}).all()
+        ids = [r[0] for r in rows]
+    else:
+        q = FileRecord.query
+        for t in tokens:
+            q = q.filter(db.or_(
+                FileRecord.file_number.contains(t, autoescape=True),
+                FileRecord.name.contains(t, autoescape=True),
+                FileRecord.department.contains(t, autoescape=True),
+            ))
+        ids = [f.id for f in q.limit(limit).all()]
+
+    if not ids:
+        return []
+    by_id = {f.id: f for f in FileRecord.query.filter(FileRecord.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def file_number_prefix(prefix):
+    """Filter clause for file numbers starting with ``prefix``, shaped for the index.
+
+    SQLite compares with its BINARY collation, so a range scan on the unique
+    index is exact. Postgres collations are locale-aware and may sort
+    "\\U0010ffff" before ordinary characters, so it gets an escaped LIKE
+    prefix match served by the text_pattern_ops index instead.
+    """
+    if _dialect() == "postgresql":
+        return FileRecord.file_number.startswith(prefix, autoescape=True)
+    return db.and_(
+        FileRecord.file_number >= prefix,
+        FileRecord.file_number < prefix + _PREFIX_END
+    )
+
+
+def typeahead_files(prefix, limit=10):
+    """Suggest files for a partially typed file number or company name.
+
+    Exact file-number prefixes are answered first from a file-number index
+    (see file_number_prefix); remaining slots are filled from the full-text
+    index so company and department words also match.
+    """
+    prefix = (prefix or "").strip()
+    if not prefix:
+        return []
+
+    results = []
+    for candidate in dict.fromkeys([prefix, prefix.upper()]):
+        if len(results) >= limit:
+            break
+        seen = {f.id for f in results}
+        results += [f for f in FileRecord.query.filter(
+            file_number_prefix(candidate)
+        ).order_by(FileRecord.file_number).limit(limit).all() if f.id not in seen]
+
+    if len(results) < limit:
+        seen = {f.id for f in results}
+        results += [f for f in search_files(prefix, limit=limit) if f.id not in seen]
+    return results[:limit]
+
+
+# Highlight markers: control characters cannot come from typed messages, so
+# the text around them can be escaped before they become <mark> tags
+_MARK_START, _MARK_END = "\x02", "\x03"
+SNIPPET_WORDS = 16
+
+MessageHit = namedtuple("MessageHit", "message snippet")
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+
+def _parse_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def message_search_params(args):
+    """Normalise chat search query-string arguments into a filter dict."""
+    until = _parse_date(args.get("until"))
+    try:
+        page = max(1, int(args.get("page") or 1))
+    except ValueError:
+        page = 1
+    return {
+        "q": (args.get("q") or "").strip(),
+        "room_id": _parse_id(args.get("room_id")),
+        "sender_id": _parse_id(args.get("sender_id")),
+        "since": _parse_date(args.get("since")),
+        # Inclusive of the whole "until" day
+        "until": until + timedelta(days=1) if until else None,
+        "page": page,
+    }
+
+
+def _highlight(snippet):
+    return Markup(str(escape(snippet or "")).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+
+
+def _plain_snippet(message, tokens):
+    words = (message or "").split()
+    snippet = " ".join(words[:SNIPPET_WORDS]) + (" …" if len(words) > SNIPPET_WORDS else "")
+    for token in tokens:
+        snippet = re.sub(re.escape(token), lambda m: f"{_MARK_START}{m.group(0)}{_MARK_END}", snippet, flags=re.I)
+    return snippet
+
+
+def search_messages(params, room_ids=None, limit=20):
+    """Rank chat messages matching every word prefix in ``params["q"]``.
+
+    ``room_ids`` restricts the search to the rooms the reader may open
+    (None: every room). Filters are applied inside the full-text query, so
+    only matching messages in those rooms are ranked, and snippets are
+    built for the returned page only. Pages are numbered rather than
+    keyed because the order is by relevance. Returns ``(hits, has_next)``.
+    """
+    tokens = _tokens(params["q"])
+    if not tokens or (room_ids is not None and not room_ids):
+        return [], False
+
+    if _backend == "fts5":
+        fts = table("chat_messages_fts", column("rowid"))
+        match = literal_column("chat_messages_fts").op("MATCH")(_fts5_match(tokens))
+        rank = func.bm25(literal_column("chat_messages_fts"))
+        snippet = func.snippet(literal_column("chat_messages_fts"), 0, _MARK_START, _MARK_END, "…", SNIPPET_WORDS)
+        query = select(ChatMessage.id, snippet) \
+            .select_from(fts.join(ChatMessage, ChatMessage.id == fts.c.rowid)) \
+            .where(match).order_by(rank, ChatMessage.id.desc())
+    elif _backend == "tsvector":
+        tsquery = func.to_tsquery("simple", _tsquery(tokens))
+        # Spelled as in ix_chat_messages_search so the planner uses it
+        document = literal_column(_POSTGRES_CHAT_DOCUMENT)
+        options = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=6"
+        snippet = func.ts_headline("simple", func.coalesce(ChatMessage.message, ""), tsquery, options)
+        query = select(ChatMessage.id, snippet) \
+            .where(document.op("@@")(tsquery)) \
+            .order_by(func.ts_rank(document, tsquery).desc(), ChatMessage.id.desc())
+    else:
+        query = select(ChatMessage.id, ChatMessage.message)
+        for t in tokens:
+            query = query.where(ChatMessage.message.contains(t, autoescape=True))
+        query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+
+    if room_ids is not None:
+        query = query.where(ChatMessage.room_id.in_(room_ids))
+    if params["room_id"] is not None:
+        query = query.where(ChatMessage.room_id == params["room_id"])
+    if params["sender_id"] is not None:
+        query = query.where(ChatMessage.sender_id == params["sender_id"])
+    if params["since"]:
+        query = query.where(ChatMessage.timestamp >= params["since"])
+    if params["until"]:
+        query = query.where(ChatMessage.timestamp < params["until"])
+
+    rows = db.session.execute(query.limit(limit + 1).offset((params["page"] - 1) * limit)).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], False
+
+    messages = {m.id: m for m in ChatMessage.query.filter(ChatMessage.id.in_([r[0] for r in rows]))
+                .options(joinedload(ChatMessage.sender), joinedload(ChatMessage.room)).all()}
+    hits = []
+    for message_id, snippet in rows:
+        if _backend is None:
+            snippet = _plain_snippet(snippet, tokens)
+        hits.append(MessageHit(messages[message_id], _highlight(snippet)))
+    return hits, has_next
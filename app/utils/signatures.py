@@ -0,0 +1,156 @@
+import base64
+import binascii
+import hashlib
+import io
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import FileTransaction, SignatureBlob, TransactionSignature
+
+KINDS = ("checkout", "return")
+MAX_SIGNATURE_BYTES = 512 * 1024
+# What signature pads export; anything else is refused before decoding
+IMAGE_TYPES = ("image/png", "image/jpeg", "image/webp")
+
+
+def decode_data_url(value):
+    """Return ``(content_type, bytes)`` for a PNG/JPEG/WebP base64 data URL, or None."""
+    if not value or not value.startswith("data:") or ";base64," not in value:
+        return None
+    header, payload = value[5:].split(";base64,", 1)
+    if header.lower() not in IMAGE_TYPES:
+        return None
+    try:
+        raw = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not raw or len(raw) > MAX_SIGNATURE_BYTES:
+        return None
+    return header or "image/png", raw
+
+
+def _is_grey(image):
+    # Only visible pixels count; fully transparent ones often carry stray colour
+    from PIL import ImageChops
+    r, g, b, a = image.split()
+    return all(
+        ImageChops.multiply(ImageChops.difference(x, y), a).getbbox() is None
+        for x, y in ((r, g), (g, b))
+    )
+
+
+def compact_image(raw):
+    """Re-encode a signature pad image as an optimised PNG, or None if it is not an image.
+
+    Pads export full RGBA canvases of strokes on transparency. Black or grey
+    ink is stored as grey + alpha, which roughly halves the size without
+    visible loss; coloured ink (e.g. blue) keeps its colour, as a palette if
+    it came as one. The bytes are always re-encoded, never stored as
+    received, so only a PNG produced here is ever served back.
+    """
+    try:
+        from PIL import Image
+        image = Image.open(io.BytesIO(raw))
+        rgba = image.convert("RGBA")
+        if _is_grey(rgba):
+            image = rgba.convert("LA")
+        elif image.mode != "P":
+            image = rgba
+        out = io.BytesIO()
+        image.save(out, "PNG", optimize=True)
+    except Exception:
+        return None
+    return out.getvalue()
+
+
+def _store_blob(data, content_type):
+    digest = hashlib.sha256(data).hexdigest()
+    if db.session.get(SignatureBlob, digest) is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(SignatureBlob(sha256=digest, content_type=content_type, size=len(data), data=data))
+        except IntegrityError:
+            # Stored concurrently by another request; the row is usable as is
+            pass
+    return digest
+
+
+def attach_signature(tx, kind, data_url):
+    """Store a signature pad data URL against ``tx``. Returns False if it is not a valid image."""
+    decoded = decode_data_url(data_url)
+    data = compact_image(decoded[1]) if decoded else None
+    if data is None:
+        return False
+    digest = _store_blob(data, "image/png")
+    db.session.add(TransactionSignature(transaction=tx, kind=kind, blob_sha256=digest))
+    return True
+
+
+def load_signature(tx_id, kind):
+    """Return the stored signature blob for a transaction.
+
+    A legacy value still held in file_transactions is decoded and served as
+    an unsaved SignatureBlob; "flask migrate-signatures" moves those into
+    the store, so reads never write.
+    """
+    blob = SignatureBlob.query.join(
+        TransactionSignature, TransactionSignature.blob_sha256 == SignatureBlob.sha256
+    ).filter(
+        TransactionSignature.transaction_id == tx_id, TransactionSignature.kind == kind
+    ).options(db.undefer(SignatureBlob.data)).first()
+    if blob is not None:
+        return blob
+
+    column = getattr(FileTransaction, f"{kind}_signature")
+    decoded = decode_data_url(db.session.query(column).filter(FileTransaction.id == tx_id).scalar())
+    data = compact_image(decoded[1]) if decoded else None
+    if data is None:
+        return None
+    return SignatureBlob(sha256=hashlib.sha256(data).hexdigest(), content_type="image/png", size=len(data), data=data)
+
+
+def signed_transactions(tx_ids, kind="checkout"):
+    """Ids among ``tx_ids`` that carry a ``kind`` signature, without loading any image data."""
+    if not tx_ids:
+        return set()
+    signed = {row[0] for row in db.session.query(TransactionSignature.transaction_id).filter(
+        TransactionSignature.transaction_id.in_(tx_ids), TransactionSignature.kind == kind
+    )}
+    column = getattr(FileTransaction, f"{kind}_signature")
+    signed.update(row[0] for row in db.session.query(FileTransaction.id).filter(
+        FileTransaction.id.in_(tx_ids), column.isnot(None)
+    ))
+    return signed
+
+
+def _migrate_one(tx_id, kind, legacy):
+    already = db.session.get(TransactionSignature, (tx_id, kind)) is not None
+    if not already and not attach_signature(db.session.get(FileTransaction, tx_id), kind, legacy):
+        return False
+    FileTransaction.query.filter(FileTransaction.id == tx_id).update(
+        {f"{kind}_signature": None}, synchronize_session=False
+    )
+    return True
+
+
+def migrate_legacy_signatures(batch_size=200):
+    """Move base64 signatures still held in file_transactions into the signature store.
+
+    Works in committed batches so a large table never has all of its
+    signatures in memory at once. Returns the number moved.
+    """
+    moved = 0
+    for kind in KINDS:
+        column = getattr(FileTransaction, f"{kind}_signature")
+        last_id = 0
+        while True:
+            rows = db.session.query(FileTransaction.id, column).filter(
+                FileTransaction.id > last_id, column.isnot(None)
+            ).order_by(FileTransaction.id).limit(batch_size).all()
+            if not rows:
+                break
+            for tx_id, legacy in rows:
+                if _migrate_one(tx_id, kind, legacy):
+                    moved += 1
+            db.session.commit()
+            last_id = rows[-1][0]
+    return moved
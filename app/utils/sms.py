@@ -1,7 +1,96 @@
-import africastalking
+from flask import current_app
 
-africastalking.initialize("USERNAME", "API_KEY")
-sms = africastalking.SMS
 
-def send_sms(phone, message):
-    sms.send(message, [phone])
+class FakeTransport:
+    """Records messages instead of sending them; used in development and tests.
+
+    Recipients listed in ``fail_for`` are reported as failed so retry
+    handling can be exercised.
+    """
+
+    def __init__(self, fail_for=()):
+        self.outbox = []
+        self.fail_for = set(fail_for)
+
+    def send(self, messages):
+        errors = []
+        for recipient, text in messages:
+            if recipient in self.fail_for:
+                errors.append("Fake delivery failure")
+            else:
+                self.outbox.append((recipient, text))
+                errors.append(None)
+        return errors
+
+
+class AfricasTalkingTransport:
+    def __init__(self, username, api_key, sender_id=None):
+        import africastalking
+        africastalking.initialize(username, api_key)
+        self.sms = africastalking.SMS
+        self.sender_id = sender_id
+
+    def send(self, messages):
+        """Send ``(recipient, text)`` pairs; identical texts share one API call.
+
+        Returns one error string (or None on success) per message, in order.
+        """
+        by_text = {}
+        for i, (recipient, text) in enumerate(messages):
+            by_text.setdefault(text, []).append((i, recipient))
+
+        errors = [None] * len(messages)
+        for text, targets in by_text.items():
+            try:
+                response = self.sms.send(text, [r for _, r in targets], sender_id=self.sender_id)
+            except Exception as e:
+                for i, _ in targets:
+                    errors[i] = str(e)[:250]
+                continue
+            statuses = {
+                r.get("number"): r.get("status")
+                for r in response.get("SMSMessageData", {}).get("Recipients", [])
+            }
+            for i, recipient in targets:
+                if statuses.get(recipient) != "Success":
+                    errors[i] = statuses.get(recipient) or "No delivery status returned"
+        return errors
+
+
+_transport = None
+
+
+def get_transport():
+    """The configured transport; raises RuntimeError if SMS_TRANSPORT is unset or unknown.
+
+    There is deliberately no fallback: silently "sending" through the fake
+    transport in production would mark real reminders as delivered.
+    """
+    global _transport
+    if _transport is None:
+        config = current_app.config
+        if config["SMS_TRANSPORT"] == "africastalking":
+            _transport = AfricasTalkingTransport(
+                config["AFRICASTALKING_USERNAME"],
+                config["AFRICASTALKING_API_KEY"],
+                config["AFRICASTALKING_SENDER_ID"],
+            )
+        elif config["SMS_TRANSPORT"] == "fake":
+            _transport = FakeTransport()
+        else:
+            raise RuntimeError(
+                f"SMS_TRANSPORT must be \"africastalking\" or \"fake\", not {config['SMS_TRANSPORT']!r}"
+            )
+    return _transport
+
+
+def set_transport(transport):
+    """Swap the transport, e.g. for a FakeTransport in tests."""
+    global _transport
+    _transport = transport
+
+
+def send_sms(phone, message, dedupe_key=None):
+    """Queue an SMS; it is delivered by the notification dispatcher, never inline."""
+    from app.utils.notifications import enqueue
+    return enqueue(phone, message, dedupe_key=dedupe_key)
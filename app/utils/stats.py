@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, func, text
+from sqlalchemy.exc import DBAPIError
+from app import db
+from app.models import DepartmentStats, FileRecord, FileTransaction
+from app.utils.caching import bump, cached
+from app.utils.loans import open_loans
+
+_ISSUED = "CASE WHEN {row}.is_issued THEN 1 ELSE 0 END"
+
+_SQLITE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS department_stats_ai AFTER INSERT ON files BEGIN
+        INSERT INTO department_stats(department, total, issued)
+        VALUES (coalesce(new.department, ''), 1, {_ISSUED.format(row="new")})
+        ON CONFLICT(department) DO UPDATE SET total = total + 1, issued = issued + excluded.issued;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS department_stats_ad AFTER DELETE ON files BEGIN
+        UPDATE department_stats SET total = total - 1, issued = issued - {_ISSUED.format(row="old")}
+        WHERE department = coalesce(old.department, '');
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS department_stats_au AFTER UPDATE OF department, is_issued ON files BEGIN
+        UPDATE department_stats SET total = total - 1, issued = issued - {_ISSUED.format(row="old")}
+        WHERE department = coalesce(old.department, '');
+        INSERT INTO department_stats(department, total, issued)
+        VALUES (coalesce(new.department, ''), 1, {_ISSUED.format(row="new")})
+        ON CONFLICT(department) DO UPDATE SET total = total + 1, issued = issued + excluded.issued;
+    END""",
+]
+
+_POSTGRES_TRIGGERS = [
+    f"""CREATE OR REPLACE FUNCTION department_stats_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE department_stats SET total = total - 1, issued = issued - {_ISSUED.format(row="OLD")}
+            WHERE department = coalesce(OLD.department, '');
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO department_stats(department, total, issued)
+            VALUES (coalesce(NEW.department, ''), 1, {_ISSUED.format(row="NEW")})
+            ON CONFLICT (department) DO UPDATE
+            SET total = department_stats.total + 1, issued = department_stats.issued + EXCLUDED.issued;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER department_stats_trg
+        AFTER INSERT OR DELETE OR UPDATE OF department, is_issued ON files
+        FOR EACH ROW EXECUTE FUNCTION department_stats_apply()""",
+]
+
+_REBUILD = [
+    "DELETE FROM department_stats",
+    f"""INSERT INTO department_stats(department, total, issued)
+        SELECT coalesce(department, ''), count(*), sum({_ISSUED.format(row="files")})
+        FROM files GROUP BY coalesce(department, '')""",
+]
+
+# Set by ensure_department_stats(); False means no triggers, count with GROUP BY
+_maintained = False
+
+
+_SQLITE_TRIGGER_NAMES = ("department_stats_ai", "department_stats_ad", "department_stats_au")
+
+
+def _missing_triggers(conn, dialect):
+    if dialect == "sqlite":
+        present = set(conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'department_stats_%'"
+        )).scalars())
+        return [n for n in _SQLITE_TRIGGER_NAMES if n not in present]
+    exists = conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname='department_stats_trg'")).first()
+    return [] if exists else ["department_stats_trg"]
+
+
+def ensure_department_stats():
+    """Install the triggers that maintain department_stats, if missing.
+
+    Every write path (checkouts, returns, uploads, bulk imports) goes through
+    the ``files`` table, so counting there keeps the dashboard's totals exact
+    without application code. The counters are rebuilt from ``files``
+    whenever a trigger had to be created, e.g. after an import died
+    while deferred_department_stats() had the insert trigger dropped.
+    """
+    global _maintained
+    dialect = db.engine.dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        _maintained = False
+        return
+    try:
+        with db.engine.begin() as conn:
+            rebuilt = _missing_triggers(conn, dialect)
+            if rebuilt:
+                # IF NOT EXISTS keeps the SQLite triggers that survived
+                for ddl in _SQLITE_TRIGGERS if dialect == "sqlite" else _POSTGRES_TRIGGERS:
+                    conn.execute(text(ddl))
+                _rebuild(conn)
+        _maintained = True
+    except DBAPIError:
+        _maintained = False
+        return
+    if rebuilt:
+        bump("files")
+
+
+def _rebuild(conn):
+    for sql in _REBUILD:
+        conn.execute(text(sql))
+
+
+def rebuild_department_stats():
+    """Recount department_stats from ``files``.
+
+    Runs on its own engine connection, which the session's cache hooks
+    never see, so the cached dashboard figures are dropped explicitly.
+    """
+    with db.engine.begin() as conn:
+        _rebuild(conn)
+    bump("files")
+
+
+@contextmanager
+def deferred_department_stats():
+    """Suspend per-row counter maintenance for a bulk load and recount once afterwards.
+
+    Same approach as deferred_search_index(): a single GROUP BY over
+    ``files`` is cheaper than an upsert per inserted row.
+    """
+    if not _maintained or db.engine.dialect.name != "sqlite":
+        yield
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TRIGGER IF EXISTS department_stats_ai"))
+    try:
+        yield
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(text(_SQLITE_TRIGGERS[0]))
+            _rebuild(conn)
+        bump("files")
+
+
+def _overdue_by_department():
+    # Walks only the overdue end of the open-loan age index
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config["LOAN_DUE_DAYS"])
+    department = func.coalesce(FileRecord.department, "")
+    rows = open_loans().join(FileRecord, FileRecord.id == FileTransaction.file_id).filter(
+        FileTransaction.checkout_time < cutoff
+    ).with_entities(department, func.count()).group_by(department)
+    return dict(rows.all())
+
+
+@cached("files", "transactions")
+def department_counts():
+    """Per-department ``{"department", "total", "issued", "overdue"}`` rows, largest first.
+
+    Totals and issued counts come from the trigger-maintained counters, so
+    the cost follows the number of departments rather than files. Overdue
+    depends on the clock and is counted over open overdue loans only; the
+    cache timeout bounds how late a loan turning overdue shows up.
+    """
+    if _maintained:
+        rows = db.session.query(DepartmentStats.department, DepartmentStats.total, DepartmentStats.issued) \
+            .filter(DepartmentStats.total > 0).all()
+    else:
+        department = func.coalesce(FileRecord.department, "")
+        rows = db.session.query(
+            department, func.count(FileRecord.id),
+            func.sum(case((FileRecord.is_issued == True, 1), else_=0))
+        ).group_by(department).all()
+
+    overdue = _overdue_by_department()
+    counts = [
+        {"department": d or "No Department", "total": total, "issued": int(issued or 0), "overdue": overdue.get(d, 0)}
+        for d, total, issued in rows
+    ]
+    return sorted(counts, key=lambda c: c["total"], reverse=True)
+
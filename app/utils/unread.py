@@ -0,0 +1,162 @@
+from sqlalchemy import event, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from app import cache, db
+from app.models import ChatMessage, ChatRoomMember
+from app.utils.caching import bump, namespace_versions
+
+_SQLITE_TRIGGERS = [
+    """CREATE TRIGGER chat_unread_ai AFTER INSERT ON chat_messages BEGIN
+        UPDATE chat_room_members SET unread_count = coalesce(unread_count, 0) + 1
+        WHERE room_id = new.room_id AND user_id != new.sender_id;
+    END""",
+    """CREATE TRIGGER chat_unread_ad AFTER DELETE ON chat_messages BEGIN
+        UPDATE chat_room_members SET unread_count = max(coalesce(unread_count, 0) - 1, 0)
+        WHERE room_id = old.room_id AND user_id != old.sender_id AND old.timestamp > last_read_at;
+    END""",
+]
+
+_POSTGRES_TRIGGERS = [
+    """CREATE OR REPLACE FUNCTION chat_unread_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE chat_room_members SET unread_count = coalesce(unread_count, 0) + 1
+            WHERE room_id = NEW.room_id AND user_id <> NEW.sender_id;
+        ELSE
+            UPDATE chat_room_members SET unread_count = greatest(coalesce(unread_count, 0) - 1, 0)
+            WHERE room_id = OLD.room_id AND user_id <> OLD.sender_id AND OLD.timestamp > last_read_at;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER chat_unread_trg
+        AFTER INSERT OR DELETE ON chat_messages
+        FOR EACH ROW EXECUTE FUNCTION chat_unread_apply()""",
+]
+
+_REBUILD = """UPDATE chat_room_members SET unread_count = (
+    SELECT count(*) FROM chat_messages m
+    WHERE m.room_id = chat_room_members.room_id
+      AND m.sender_id != chat_room_members.user_id
+      AND m.timestamp > chat_room_members.last_read_at
+)"""
+
+# Set by ensure_unread_counters(); False means no triggers, count messages instead
+_maintained = False
+
+_PENDING = "unread_users"
+_PENDING_ALL = "unread_all"
+
+
+def _trigger_exists(conn, dialect):
+    if dialect == "sqlite":
+        sql = "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='chat_unread_ai'"
+    else:
+        sql = "SELECT 1 FROM pg_trigger WHERE tgname='chat_unread_trg'"
+    return conn.execute(text(sql)).first() is not None
+
+
+def ensure_unread_counters():
+    """Install the triggers that keep chat_room_members.unread_count current.
+
+    Every stored message bumps the counter of each other member of its room,
+    whichever route, socket handler or API stored it; reading the room resets
+    it (see mark_read). Counters are rebuilt once, when the triggers are
+    first installed.
+    """
+    global _maintained
+    dialect = db.engine.dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        _maintained = False
+        return
+    try:
+        with db.engine.begin() as conn:
+            if not _trigger_exists(conn, dialect):
+                for ddl in _SQLITE_TRIGGERS if dialect == "sqlite" else _POSTGRES_TRIGGERS:
+                    conn.execute(text(ddl))
+                conn.execute(text(_REBUILD))
+        _maintained = True
+    except DBAPIError:
+        _maintained = False
+
+
+def mark_read(member, when):
+    """Advance ``member``'s read marker to ``when``. The caller commits."""
+    member.last_read_at = when
+    member.unread_count = 0
+
+
+def unread_by_room(user_id):
+    """``{room_id: unread}`` for every room ``user_id`` is a member of."""
+    if _maintained:
+        rows = db.session.query(ChatRoomMember.room_id, func.coalesce(ChatRoomMember.unread_count, 0)) \
+            .filter(ChatRoomMember.user_id == user_id)
+        return dict(rows.all())
+    rows = db.session.query(ChatRoomMember.room_id, func.count(ChatMessage.id)) \
+        .outerjoin(ChatMessage, db.and_(
+            ChatMessage.room_id == ChatRoomMember.room_id,
+            ChatMessage.sender_id != ChatRoomMember.user_id,
+            ChatMessage.timestamp > ChatRoomMember.last_read_at,
+        )) \
+        .filter(ChatRoomMember.user_id == user_id) \
+        .group_by(ChatRoomMember.room_id)
+    return dict(rows.all())
+
+
+def _total_keys(user_ids):
+    version = namespace_versions(("unread",))[0]
+    return [f"unread:{version}:{user_id}" for user_id in user_ids]
+
+
+def unread_total(user_id):
+    """Unread messages across all of ``user_id``'s rooms, for the navbar badge.
+
+    Served from the shared cache; the entry is dropped whenever a message
+    reaches one of the user's rooms or one of their read markers moves.
+    """
+    key, = _total_keys([user_id])
+    total = cache.get(key)
+    if total is None:
+        total = sum(unread_by_room(user_id).values())
+        cache.set(key, total)
+    return total
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    users = {
+        obj.user_id for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, ChatRoomMember)
+    }
+    rooms = {obj.room_id for obj in session.new if isinstance(obj, ChatMessage)}
+    if rooms:
+        users.update(session.connection().execute(
+            select(ChatRoomMember.user_id).where(ChatRoomMember.room_id.in_(rooms))
+        ).scalars())
+    if users:
+        session.info.setdefault(_PENDING, set()).update(users)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(state):
+    # Bulk updates and deletes (e.g. deleting a room) don't say whose counts
+    # changed, so they drop every cached total
+    if state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None and table.name in ("chat_messages", "chat_room_members"):
+            state.session.info[_PENDING_ALL] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    users = session.info.pop(_PENDING, None)
+    if session.info.pop(_PENDING_ALL, False):
+        bump("unread")
+    elif users:
+        cache.delete_many(*_total_keys(users))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING, None)
+        session.info.pop(_PENDING_ALL, None)
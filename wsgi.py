@@ -21,3 +21,5 @@ if __name__ == "__main__":
 
 # For production, use: gunicorn --worker-class eventlet -w 1 wsgi:app
 # Ensure eventlet is installed: pip install eventlet
+# With more than one worker set SOCKETIO_MESSAGE_QUEUE (e.g. redis://) so
+# live updates reach sockets held by every worker